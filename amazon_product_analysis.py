@@ -1,16 +1,28 @@
 import os
 import time
 import random
+import re
 import json
+import argparse
+import hashlib
+import threading
+import queue
+import shutil
+from collections import deque
+import numpy as np
 import pandas as pd
 import requests
-from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+from PIL import Image, ImageStat
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
+from contextlib import closing, contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import (
     TimeoutException, 
     NoSuchElementException, 
@@ -18,7 +30,7 @@ from selenium.common.exceptions import (
     WebDriverException,
     StaleElementReferenceException
 )
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APIStatusError, RateLimitError
 from dashscope import MultiModalConversation
 
 #####################################
@@ -30,11 +42,130 @@ API_KEY = 'xxx'
 BASE_URL = 'xxx'
 MODEL_NAME = 'qwen2.5-vl-72b-instruct'  # 'qvq-72b-preview'
 
+# API限流与重试配置：客户端令牌桶按每分钟请求数和token数限流，收到限流响应后自动降速再逐步恢复
+VISION_API_RPM = 60
+VISION_API_TPM = 1000000
+TEXT_API_RPM = 120
+TEXT_API_TPM = 1000000
+API_MAX_RETRIES = 4  # 限流、服务端错误和网络错误的重试次数
+API_BACKOFF_SECONDS = 1.0  # 重试的初始等待时间，每次翻倍并加入随机抖动
+API_MAX_BACKOFF_SECONDS = 30.0
+CIRCUIT_BREAKER_THRESHOLD = 5  # 连续失败该次数后熔断，暂停调用该API
+CIRCUIT_BREAKER_COOLDOWN_SECONDS = 60  # 熔断后经过该时间允许一次试探调用
+
+# 关键词提取配置
+KEYWORD_MODEL = 'qwen-max-2025-01-25'
+KEYWORD_BATCH_SIZE = 20  # 每次请求提取关键词的产品名数量
+KEYWORD_CACHE_FILE = './keyword_cache.json'
+
 # 图片目录配置
 IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png']
 AMAZON_IMAGE_DIRECTORY = './images'
 MY_IMAGE_DIRECTORY = './my_product_images'
 
+# 爬虫后端配置：'selenium'使用浏览器爬取，'http'直接请求搜索结果页
+SCRAPER_BACKEND = 'selenium'
+AMAZON_BASE_URL = 'https://www.amazon.com'
+HTTP_POOL_SIZE = 8  # HTTP后端的连接池大小及并行爬取的搜索词数量
+
+# 多页爬取配置：第1页的产品不够时继续读取后续结果页，按ASIN去重，产品数量足够后停止
+SEARCH_MAX_PAGES = 5  # 每个搜索词最多读取的结果页数
+SEARCH_PAGE_CONCURRENCY = 3  # 同时加载的结果页数（浏览器后端为同时打开的标签页数）
+
+# 图片下载配置
+DOWNLOAD_MAX_WORKERS = 8  # 同时进行的图片下载数量
+DOWNLOAD_RETRIES = 3  # 下载失败后的重试次数
+DOWNLOAD_BACKOFF_SECONDS = 0.5  # 重试的初始等待时间，每次重试翻倍
+
+# 全局图片库配置：所有搜索词共享按内容哈希保存的图片，images/<搜索词>中的图片是指向图片库的硬链接
+# 同一图片URL只下载一次；设为None时直接下载到各搜索词目录
+IMAGE_STORE_DIRECTORY = './image_store'
+
+# 流水线配置（爬取阶段的并发数由BROWSER_POOL_SIZE或HTTP_POOL_SIZE决定）
+PIPELINE_QUEUE_SIZE = 4  # 相邻阶段之间队列的最大长度
+PIPELINE_DOWNLOAD_WORKERS = 2
+PIPELINE_KEYWORD_WORKERS = 1
+PIPELINE_COMPARE_WORKERS = 1  # 每个比较任务内部还会按ANALYZE_MAX_WORKERS并发调用模型
+
+# 页面节奏配置：以页面就绪信号（结果列表出现、网络空闲）代替固定等待，
+# 反爬虫停顿按场景配置随机区间(秒)，设为None或关闭PACING_ENABLED可去掉对应停顿
+PACING_ENABLED = True
+PACING_POLICY = {
+    'after_open': (2.0, 4.0),  # 打开首页后，原为固定的15-20秒
+    'before_typing': (0.3, 0.8),
+    'before_submit': (0.3, 0.8),
+    'after_results': (0.5, 1.5),
+}
+PAGE_READY_TIMEOUT = 15  # 等待页面就绪信号的最长时间
+NETWORK_IDLE_SECONDS = 0.5  # 持续这么久没有新的网络活动视为网络空闲
+NETWORK_IDLE_MAX_INFLIGHT = 2  # 允许的未完成请求数（忽略长连接等永不结束的请求）
+
+# 浏览器会话池配置
+BROWSER_POOL_SIZE = 2  # 同时打开的浏览器数量，即并行爬取的搜索词数量
+BROWSER_MAX_USES = 20  # 每个浏览器会话最多执行的搜索次数，之后重新创建
+BROWSER_HEADLESS = False
+
+# 并发分析配置（同时进行中的图像分析请求数）
+ANALYZE_MAX_WORKERS = 4
+
+# 竞品判定缓存配置（模型或提示词变化时缓存自动失效）
+VERDICT_CACHE_DIRECTORY = './verdict_cache'
+VERDICT_CACHE_MAX_AGE_DAYS = 30
+VERDICT_CACHE_MAX_SIZE_MB = 200
+
+# 图片校验与近似去重配置
+MIN_IMAGE_SIDE = 50  # 任一边小于该像素数视为占位图
+PLACEHOLDER_MAX_STDDEV = 3.0  # 灰度标准差低于该值视为纯色占位图
+DEDUP_HAMMING_THRESHOLD = 6  # 感知哈希汉明距离不超过该值视为同一张图
+
+# 图片预处理分级配置：发送给视觉模型前按分级缩放并重新编码为JPEG，派生图片按原图内容哈希缓存
+# None表示发送原图并开启高分辨率模式（与旧版本一致）；可先用--benchmark-tiers比较各分级再选择
+IMAGE_TIERS = {
+    'full': None,
+    'large': {"max_side": 1280, "quality": 90},
+    'medium': {"max_side": 768, "quality": 85},
+    'small': {"max_side": 448, "quality": 80},
+}
+VLM_IMAGE_TIER = 'full'
+DERIVED_IMAGE_DIRECTORY = './derived_images'
+
+# 图片上传缓存配置：每张本地图片按内容哈希只上传一次到DashScope临时存储，有效期内的请求直接引用oss://地址
+# UPLOAD_POLICY_URL可指向本地替身服务器进行测试；上传失败时退回由SDK随请求上传
+UPLOAD_CACHE_ENABLED = True
+UPLOAD_POLICY_URL = 'https://dashscope.aliyuncs.com/api/v1/uploads'
+UPLOAD_URL_TTL_SECONDS = 48 * 3600  # 临时存储中文件的有效期
+UPLOAD_URL_REFRESH_MARGIN_SECONDS = 3600  # 距离过期不足该时间时重新上传
+UPLOAD_CACHE_FILE = './upload_cache.json'
+
+# 流式比较配置：逐段读取模型回复，解析到"结论：YES/NO"后立即返回并断开连接，不再等待后面的理由
+# 审计时将KEEP_FULL_REASONING设为True，仍然流式读取但等待完整回复，判定缓存中保存完整的理由
+VLM_STREAMING = True
+KEEP_FULL_REASONING = False
+
+# 批量图像比较配置：每次请求发送我的产品图片和最多VLM_BATCH_SIZE张候选图片，为1时逐对比较
+# 批量回复格式异常时自动退回逐对比较
+VLM_BATCH_SIZE = 1
+
+# 本地视觉预筛选配置：调用视觉模型前用颜色直方图、边缘方向直方图和缩略图计算与我的产品的相似度(-1到1)，
+# 低于VISUAL_SIMILARITY_FLOOR的候选直接判定为NO；调整阈值前可用--visual-agreement对照已缓存的模型结论
+VISUAL_SIMILARITY_FLOOR = 0.1
+VISUAL_FEATURE_WEIGHTS = {'color': 0.4, 'edge': 0.3, 'thumbnail': 0.3}
+VISUAL_FEATURE_SIZE = 64  # 提取特征前将图片缩放到的边长
+
+# 竞品判定流水线配置（各阶段按成本从低到高执行，任一阶段判定为NO即停止）
+DECISION_STAGES = ['title', 'visual', 'image']
+FULL_EVALUATION = False  # 审计模式：所有产品都执行全部阶段
+
+# 运行指标配置：各环节的耗时和计数在运行结束时导出为JSON摘要和Prometheus文本文件
+# （可放在node_exporter的textfile收集目录中），设为None时不导出对应文件
+METRICS_ENABLED = True
+METRICS_SUMMARY_FILE = './run_metrics.json'
+METRICS_PROMETHEUS_FILE = './run_metrics.prom'
+
+# 检查点日志与报告配置
+JOURNAL_FILE = './analysis_journal.jsonl'  # 每个搜索词的结果追加写入该文件，重启后从中恢复
+REPORT_FILE = '产品相似度分析结果.xlsx'
+
 # 标注提示配置
 SYSTEM_PROMPT = "You are a helpful assistant."
 USER_PROMPT = '''
@@ -88,6 +219,423 @@ USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.164 Safari/537.36',
 ]
 
+#####################################
+# 运行指标
+#####################################
+
+class MetricsRegistry:
+    """进程内的轻量指标：耗时区间(span)和计数器，按名称和标签区分序列
+    
+    每次记录只在锁内更新几个数字并追加一个样本（每个序列最多保留MAX_SAMPLES个用于计算分位数），
+    开销在微秒级，可以在正式运行中常开。
+    """
+    
+    MAX_SAMPLES = 2048
+    QUANTILES = (0.5, 0.95, 0.99)
+    
+    def __init__(self, enabled=METRICS_ENABLED, prefix='amazon_analysis'):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.started_at = time.time()
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _series_key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+    
+    def observe(self, name, seconds, error=False, **labels):
+        """记录一次耗时"""
+        if not self.enabled:
+            return
+        series_key = self._series_key(name, labels)
+        with self._lock:
+            series = self._spans.get(series_key)
+            if series is None:
+                series = self._spans[series_key] = {
+                    "count": 0, "sum": 0.0, "max": 0.0, "errors": 0, "samples": deque(maxlen=self.MAX_SAMPLES)
+                }
+            series["count"] += 1
+            series["sum"] += seconds
+            series["max"] = max(series["max"], seconds)
+            series["errors"] += int(error)
+            series["samples"].append(seconds)
+    
+    @contextmanager
+    def span(self, name, **labels):
+        """记录with块的耗时，块内抛出异常时计入错误次数"""
+        if not self.enabled:
+            yield
+            return
+        start_time = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start_time, error, **labels)
+    
+    def count(self, name, value=1, **labels):
+        """计数器增加value"""
+        if not self.enabled or not value:
+            return
+        series_key = self._series_key(name, labels)
+        with self._lock:
+            self._counters[series_key] = self._counters.get(series_key, 0) + value
+    
+    def summary(self):
+        """返回所有序列的统计，耗时序列包含分位数"""
+        with self._lock:
+            spans = {key: dict(series, samples=sorted(series["samples"])) for key, series in self._spans.items()}
+            counters = dict(self._counters)
+        
+        span_list = []
+        for (name, labels), series in sorted(spans.items()):
+            samples = series.pop("samples")
+            for quantile in self.QUANTILES:
+                series[f"p{int(quantile * 100)}"] = (
+                    samples[min(len(samples) - 1, int(len(samples) * quantile))] if samples else 0.0
+                )
+            span_list.append(dict(name=name, labels=dict(labels), **series))
+        counter_list = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(counters.items())
+        ]
+        return {
+            "started_at": self.started_at,
+            "duration_seconds": time.time() - self.started_at,
+            "spans": span_list,
+            "counters": counter_list,
+        }
+    
+    @staticmethod
+    def _format_labels(labels, **extra):
+        labels = dict(labels, **extra)
+        if not labels:
+            return ''
+        pairs = []
+        for key, value in labels.items():
+            # 标签值中的反斜杠、双引号和换行需要转义
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{key}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+    
+    def to_prometheus(self, summary=None):
+        """按Prometheus文本格式输出：耗时为summary类型，计数器为counter类型"""
+        if summary is None:
+            summary = self.summary()
+        lines = [
+            f"# TYPE {self.prefix}_run_start_timestamp_seconds gauge",
+            f"{self.prefix}_run_start_timestamp_seconds {summary['started_at']:.3f}",
+            f"# TYPE {self.prefix}_run_duration_seconds gauge",
+            f"{self.prefix}_run_duration_seconds {summary['duration_seconds']:.3f}",
+        ]
+        # 同一指标的所有序列必须连续输出，因此按名称分组
+        span_families = {}
+        for series in summary["spans"]:
+            span_families.setdefault(series["name"], []).append(series)
+        for name, family in span_families.items():
+            metric = f"{self.prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for series in family:
+                for quantile in self.QUANTILES:
+                    labels = self._format_labels(series["labels"], quantile=quantile)
+                    lines.append(f"{metric}{labels} {series[f'p{int(quantile * 100)}']:.6f}")
+                labels = self._format_labels(series["labels"])
+                lines.append(f"{metric}_sum{labels} {series['sum']:.6f}")
+                lines.append(f"{metric}_count{labels} {series['count']}")
+            lines.append(f"# TYPE {self.prefix}_{name}_errors_total counter")
+            for series in family:
+                lines.append(f"{self.prefix}_{name}_errors_total{self._format_labels(series['labels'])} {series['errors']}")
+        
+        declared = set()
+        for series in summary["counters"]:
+            metric = f"{self.prefix}_{series['name']}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{self._format_labels(series['labels'])} {series['value']}")
+        return '\n'.join(lines) + '\n'
+    
+    def export(self, summary_file=None, prometheus_file=None, verbose=True):
+        """把运行摘要写入JSON文件和Prometheus文本文件（先写临时文件再替换），返回摘要"""
+        summary = self.summary()
+        outputs = [
+            (summary_file, lambda: json.dumps(summary, ensure_ascii=False, indent=1)),
+            (prometheus_file, lambda: self.to_prometheus(summary)),
+        ]
+        for path, render in outputs:
+            if not path:
+                continue
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(render())
+                os.replace(temp_path, path)
+            except OSError as e:
+                print(f"导出运行指标失败: {e}")
+        if verbose and (summary_file or prometheus_file):
+            print(f"运行指标已导出: {', '.join(path for path, _ in outputs if path)}")
+        return summary
+
+METRICS = MetricsRegistry()
+
+#####################################
+# API限流与重试
+#####################################
+
+class ApiCallError(Exception):
+    """API返回了非成功状态码"""
+    
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class TransientApiError(Exception):
+    """API暂时不可用：重试次数用尽或已熔断，稍后重新运行可以恢复"""
+
+class CircuitOpenError(TransientApiError):
+    """API已熔断，调用被直接拒绝"""
+
+def classify_api_error(error):
+    """判断异常是否为限流以及是否值得重试，返回(是否限流, 是否可重试, 建议等待秒数)"""
+    status_code = None
+    retry_after = None
+    if isinstance(error, ApiCallError):
+        status_code = error.status_code
+        retry_after = error.retry_after
+    elif isinstance(error, APIStatusError):
+        status_code = error.status_code
+        try:
+            retry_after = float(error.response.headers.get('retry-after'))
+        except (TypeError, ValueError, AttributeError):
+            retry_after = None
+    elif isinstance(error, (APIConnectionError, requests.RequestException)):
+        return False, True, None
+    
+    if isinstance(error, RateLimitError) or status_code == 429:
+        return True, True, retry_after
+    if status_code is not None and status_code >= 500:
+        return False, True, retry_after
+    return False, False, None
+
+class AdaptiveRateLimiter:
+    """按每分钟请求数(RPM)和每分钟token数(TPM)限流的令牌桶
+    
+    收到限流响应时速率减半，之后每次成功调用逐步恢复到配置的速率。
+    桶容量为10秒的配额，token按调用前的估计值扣除，调用后按实际用量修正。
+    """
+    
+    def __init__(self, rpm, tpm=None, min_fraction=0.1, recovery_step=0.05):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_fraction = min_fraction
+        self.recovery_step = recovery_step
+        self.fraction = 1.0
+        self.waited_seconds = 0.0
+        self._requests = self._request_capacity()
+        self._tokens = self._token_capacity()
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _request_capacity(self):
+        return max(1.0, self.rpm * self.fraction / 6)
+    
+    def _token_capacity(self):
+        return max(1.0, self.tpm * self.fraction / 6) if self.tpm else 0.0
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._requests = min(self._request_capacity(), self._requests + elapsed * self.rpm * self.fraction / 60)
+        if self.tpm:
+            self._tokens = min(self._token_capacity(), self._tokens + elapsed * self.tpm * self.fraction / 60)
+    
+    def acquire(self, tokens=0):
+        """等待直到请求数和token数配额都足够，返回等待的秒数"""
+        start_time = time.monotonic()
+        while True:
+            with self._lock:
+                self._refill()
+                # 单次请求的估计token数超过桶容量时，只要求桶是满的
+                needed_tokens = min(tokens, self._token_capacity()) if self.tpm else 0
+                if self._requests >= 1 and (not self.tpm or self._tokens >= needed_tokens):
+                    self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= tokens
+                    waited = time.monotonic() - start_time
+                    self.waited_seconds += waited
+                    return waited
+                wait = (1 - self._requests) * 60 / (self.rpm * self.fraction)
+                if self.tpm:
+                    wait = max(wait, (needed_tokens - self._tokens) * 60 / (self.tpm * self.fraction))
+            time.sleep(min(max(wait, 0.01), 1.0))
+    
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """按实际token用量修正调用前的估计值"""
+        if self.tpm and actual_tokens:
+            with self._lock:
+                self._tokens -= actual_tokens - estimated_tokens
+    
+    def on_throttled(self):
+        """收到限流响应：速率减半并清空请求配额"""
+        with self._lock:
+            self.fraction = max(self.min_fraction, self.fraction / 2)
+            self._requests = min(self._requests, 0.0)
+    
+    def on_success(self):
+        with self._lock:
+            self.fraction = min(1.0, self.fraction + self.recovery_step)
+
+class ResilientApiClient:
+    """在API调用外层统一限流、重试和熔断，并统计调用次数
+    
+    限流、服务端错误和网络错误按带抖动的指数退避重试；连续CIRCUIT_BREAKER_THRESHOLD次调用
+    最终失败后熔断，冷却时间过后只放行一次试探调用，成功则恢复。
+    """
+    
+    def __init__(self, name, rpm, tpm=None, max_retries=API_MAX_RETRIES, backoff_seconds=API_BACKOFF_SECONDS,
+                 max_backoff_seconds=API_MAX_BACKOFF_SECONDS, failure_threshold=CIRCUIT_BREAKER_THRESHOLD,
+                 cooldown_seconds=CIRCUIT_BREAKER_COOLDOWN_SECONDS, metric_label=None):
+        self.name = name
+        self.metric_label = metric_label or name
+        self.limiter = AdaptiveRateLimiter(rpm, tpm)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.stats = {
+            "calls": 0,
+            "succeeded": 0,
+            "throttled": 0,
+            "retried": 0,
+            "failed": 0,
+            "rejected": 0,
+        }
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    def _check_circuit(self):
+        with self._lock:
+            self.stats["calls"] += 1
+            if self._opened_at is None:
+                return
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown_seconds:
+                self.stats["rejected"] += 1
+                METRICS.count('api_calls', api=self.metric_label, result='rejected')
+                raise CircuitOpenError(f"{self.name}API已熔断，暂停调用")
+            # 冷却结束，放行一次试探调用
+            self._probing = True
+    
+    def _record_result(self, succeeded, counts_as_failure=True):
+        METRICS.count('api_calls', api=self.metric_label, result='succeeded' if succeeded else 'failed')
+        with self._lock:
+            if succeeded:
+                self.stats["succeeded"] += 1
+            else:
+                self.stats["failed"] += 1
+            if succeeded or not counts_as_failure:
+                self._consecutive_failures = 0
+                self._opened_at = None
+            else:
+                self._consecutive_failures += 1
+                if self._probing or self._consecutive_failures >= self.failure_threshold:
+                    if self._opened_at is None or self._probing:
+                        print(f"{self.name}API连续失败 {self._consecutive_failures} 次，"
+                              f"熔断 {self.cooldown_seconds} 秒")
+                    self._opened_at = time.monotonic()
+            self._probing = False
+    
+    def _backoff(self, attempt, retry_after=None):
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * (2 ** (attempt - 1)))
+        # 在退避时间附近随机抖动，避免并发线程同时重试
+        delay *= random.uniform(0.5, 1.5)
+        if retry_after:
+            delay = max(delay, retry_after)
+        time.sleep(delay)
+        return delay
+    
+    def call(self, func, estimated_tokens=0, span_name=None, span_labels=None):
+        """限流后调用func并在需要时重试，func返回(结果, 实际token用量)，本方法返回结果
+        
+        提供span_name时每次实际请求单独记录耗时，限流等待和重试退避记录为api_wait，不计入请求耗时。
+        重试用尽或已熔断时抛出TransientApiError；其他错误（如参数错误）直接抛出原异常。
+        """
+        self._check_circuit()
+        retry_after = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                with self._lock:
+                    self.stats["retried"] += 1
+                METRICS.count('api_retries', api=self.metric_label)
+                METRICS.observe('api_wait', self._backoff(attempt, retry_after), api=self.metric_label, reason='backoff')
+            METRICS.observe('api_wait', self.limiter.acquire(estimated_tokens), api=self.metric_label, reason='limiter')
+            try:
+                if span_name:
+                    with METRICS.span(span_name, **(span_labels or {})):
+                        result, used_tokens = func()
+                else:
+                    result, used_tokens = func()
+            except Exception as e:
+                throttled, retryable, retry_after = classify_api_error(e)
+                if throttled:
+                    with self._lock:
+                        self.stats["throttled"] += 1
+                    METRICS.count('api_throttled', api=self.metric_label)
+                    self.limiter.on_throttled()
+                if not retryable:
+                    self._record_result(False, counts_as_failure=False)
+                    raise
+                if attempt == self.max_retries:
+                    self._record_result(False)
+                    raise TransientApiError(f"{self.name}API调用失败，已重试 {self.max_retries} 次: {e}") from e
+                continue
+            self.limiter.record_usage(estimated_tokens, used_tokens)
+            METRICS.count('api_tokens', used_tokens, api=self.metric_label)
+            self.limiter.on_success()
+            self._record_result(True)
+            return result
+    
+    def report(self):
+        """输出调用、限流、重试和失败次数"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["rate_fraction"] = self.limiter.fraction
+        stats["limiter_wait_seconds"] = round(self.limiter.waited_seconds, 2)
+        if stats["calls"]:
+            print(f"{self.name}API: 调用 {stats['calls']} 次，成功 {stats['succeeded']} 次，"
+                  f"限流 {stats['throttled']} 次，重试 {stats['retried']} 次，失败 {stats['failed']} 次，"
+                  f"熔断拒绝 {stats['rejected']} 次，限流等待 {stats['limiter_wait_seconds']} 秒，"
+                  f"当前速率 {stats['rate_fraction'] * 100:.0f}%")
+        return stats
+
+VISION_API_CLIENT = ResilientApiClient('视觉模型', VISION_API_RPM, VISION_API_TPM, metric_label='vision')
+TEXT_API_CLIENT = ResilientApiClient('文本模型', TEXT_API_RPM, TEXT_API_TPM, metric_label='text')
+
+def check_dashscope_response(response):
+    """DashScope调用失败时返回的是带状态码的响应而不是异常，转换为ApiCallError"""
+    status_code = getattr(response, 'status_code', 200)
+    if status_code != 200:
+        raise ApiCallError(
+            f"{getattr(response, 'code', '')}: {getattr(response, 'message', '')}", status_code=status_code
+        )
+    return response
+
+def estimate_image_tokens(image_path, high_resolution):
+    """按每28x28像素一个token估算图片的token数（只读取图片头信息）"""
+    with Image.open(image_path) as img:
+        width, height = img.size
+    tokens = (width // 28 + 1) * (height // 28 + 1)
+    return max(4, min(tokens, 16384 if high_resolution else 1280)) + 2
+
 #####################################
 # 辅助函数
 #####################################
@@ -101,19 +649,173 @@ def random_sleep(min_seconds=1, max_seconds=3):
     sleep_time = random.uniform(min_seconds, max_seconds)
     time.sleep(sleep_time)
 
+_openai_clients = {}
+_openai_clients_lock = threading.Lock()
+
+def get_openai_client(api_key, base_url):
+    """获取复用的OpenAI客户端，相同配置只创建一次以复用连接池"""
+    with _openai_clients_lock:
+        client = _openai_clients.get((api_key, base_url))
+        if client is None:
+            client = OpenAI(
+                api_key=api_key, 
+                base_url=base_url,
+            )
+            _openai_clients[(api_key, base_url)] = client
+        return client
+
+def build_keyword_prompt(product_name):
+    """构建单个产品名的关键词提取提示"""
+    return f'真正的产品名是标题的一部分。就是标题有很多其他修饰成分，你要从标题里面提取出关键词。例如"健康饮食，美妙的一天，当当牌轻食罐头，你值得拥有"，那么关键词就是"轻食罐头" 那么"{product_name}"这是商品名字，请问关键词是什么？请你直接输出关键词，而不要输出其他任何东西，任何说明和提示。'
+
+def build_batch_keyword_prompt(product_names):
+    """构建批量关键词提取提示，要求按顺序输出JSON字符串数组"""
+    numbered_names = "\n".join(f"{i + 1}. {name}" for i, name in enumerate(product_names))
+    return (
+        '真正的产品名是标题的一部分。就是标题有很多其他修饰成分，你要从标题里面提取出关键词。'
+        '例如"健康饮食，美妙的一天，当当牌轻食罐头，你值得拥有"，那么关键词就是"轻食罐头"。'
+        f'下面是{len(product_names)}个商品名字，请按顺序提取每个商品名的关键词：\n{numbered_names}\n'
+        f'请直接输出一个包含{len(product_names)}个字符串的JSON数组，第i个元素是第i个商品名的关键词，'
+        '不要输出其他任何东西，任何说明和提示。'
+    )
+
+def parse_batch_keywords(content, expected_count):
+    """解析批量关键词回复，格式不正确时返回None"""
+    start = content.find('[')
+    end = content.rfind(']')
+    if start == -1 or end <= start:
+        return None
+    try:
+        keywords = json.loads(content[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(keywords, list) or len(keywords) != expected_count:
+        return None
+    if not all(isinstance(keyword, str) and keyword.strip() for keyword in keywords):
+        return None
+    return [keyword.strip() for keyword in keywords]
+
+def request_chat_completion(api_key, base_url, model, prompt):
+    """调用对话模型并返回回复文本（经过限流和重试）"""
+    client = get_openai_client(api_key, base_url)
+    
+    def call():
+        completion = client.chat.completions.create(
+            model=model,
+            messages=[
+                {'role': 'system', 'content': 'You are a helpful assistant.'},
+                {'role': 'user', 'content': prompt}],
+            )
+        used_tokens = completion.usage.total_tokens if completion.usage else 0
+        return completion.choices[0].message.content.strip(), used_tokens
+    
+    return TEXT_API_CLIENT.call(call, estimated_tokens=len(prompt) + 200, span_name='keyword_call')
+
 def get_keyword(api_key, base_url, model, product_name):
     """从产品名称中提取关键词"""
-    client = OpenAI(
-        api_key=api_key, 
-        base_url=base_url,
-    )
-    completion = json.loads(client.chat.completions.create(
-        model=model,
-        messages=[
-            {'role': 'system', 'content': 'You are a helpful assistant.'},
-            {'role': 'user', 'content': f'真正的产品名是标题的一部分。就是标题有很多其他修饰成分，你要从标题里面提取出关键词。例如"健康饮食，美妙的一天，当当牌轻食罐头，你值得拥有"，那么关键词就是"轻食罐头" 那么"{product_name}"这是商品名字，请问关键词是什么？请你直接输出关键词，而不要输出其他任何东西，任何说明和提示。'}],
-        ).model_dump_json())['choices'][0]['message']['content']
-    return completion
+    return request_chat_completion(api_key, base_url, model, build_keyword_prompt(product_name))
+
+class KeywordExtractor:
+    """关键词提取服务：复用客户端、批量提取，并将结果持久缓存到磁盘"""
+    
+    def __init__(self, api_key, base_url, model, cache_file=None, batch_size=KEYWORD_BATCH_SIZE):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.cache_file = cache_file
+        self.batch_size = max(1, batch_size)
+        self.hits = 0
+        self.api_calls = 0
+        self._lock = threading.Lock()
+        self._cache = self._load_cache()
+    
+    def _load_cache(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取关键词缓存失败: {e}")
+            return {}
+    
+    def _save_cache(self):
+        """保存缓存（先写临时文件再替换，避免中断时损坏缓存文件）"""
+        if not self.cache_file:
+            return
+        try:
+            temp_path = f"{self.cache_file}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._cache, f, ensure_ascii=False, indent=1)
+            os.replace(temp_path, self.cache_file)
+        except OSError as e:
+            print(f"保存关键词缓存失败: {e}")
+    
+    def _cache_key(self, product_name):
+        return f"{self.model}|{product_name}"
+    
+    def _store(self, keywords_by_name):
+        with self._lock:
+            for product_name, keyword in keywords_by_name.items():
+                self._cache[self._cache_key(product_name)] = keyword
+            self._save_cache()
+    
+    def _extract_batch(self, product_names):
+        """一次请求提取多个产品名的关键词，回复格式不正确时逐个提取"""
+        with self._lock:
+            self.api_calls += 1
+        content = request_chat_completion(
+            self.api_key, self.base_url, self.model, build_batch_keyword_prompt(product_names)
+        )
+        keywords = parse_batch_keywords(content, len(product_names))
+        if keywords is not None:
+            return dict(zip(product_names, keywords))
+        
+        print(f"批量关键词回复格式不正确，改为逐个提取 ({len(product_names)} 个)")
+        return {product_name: self._extract_one(product_name) for product_name in product_names}
+    
+    def _extract_one(self, product_name):
+        with self._lock:
+            self.api_calls += 1
+        return get_keyword(self.api_key, self.base_url, self.model, product_name)
+    
+    def prefetch(self, product_names):
+        """批量提取所有未缓存产品名的关键词，失败的批次留待单独提取"""
+        with self._lock:
+            missing = list(dict.fromkeys(
+                str(name) for name in product_names if self._cache_key(str(name)) not in self._cache
+            ))
+        if not missing:
+            return
+        
+        print(f"批量提取 {len(missing)} 个产品名的关键词 (每批 {self.batch_size} 个)")
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            try:
+                self._store(self._extract_batch(batch))
+            except Exception as e:
+                print(f"批量提取关键词出错: {e}")
+    
+    def get(self, product_name):
+        """获取产品名的关键词，优先使用缓存"""
+        product_name = str(product_name)
+        with self._lock:
+            keyword = self._cache.get(self._cache_key(product_name))
+            if keyword is not None:
+                self.hits += 1
+                METRICS.count('cache_lookups', cache='keyword', result='hit')
+                return keyword
+        METRICS.count('cache_lookups', cache='keyword', result='miss')
+
+        keyword = self._extract_one(product_name)
+        self._store({product_name: keyword})
+        return keyword
+    
+    def report(self):
+        """输出关键词缓存统计"""
+        with self._lock:
+            print(f"关键词提取: 缓存命中 {self.hits} 次，API调用 {self.api_calls} 次")
+            return {"hits": self.hits, "api_calls": self.api_calls}
 
 def extract_my_product_name(file_path, save_to_file=False, output_file="流量词列表.txt"):
     """从Excel文件中提取第一列(流量词)数据"""
@@ -147,12 +849,17 @@ def extract_my_product_name(file_path, save_to_file=False, output_file="流量
         print(f"错误: {e}")
         raise
 
-def get_img_analyze(my_image_path, amazon_image_path):
-    """分析两张图片是否为竞品关系"""
-    # 构建图片路径格式
-    my_image_url = f"file://{os.path.abspath(my_image_path)}"
-    amazon_image_url = f"file://{os.path.abspath(amazon_image_path)}"
+def request_img_analysis_with_usage(my_image_path, amazon_image_path, tier=None):
+    """调用视觉模型分析两张图片，返回(原始回复文本, token用量)
     
+    图片先按tier分级预处理，只有原图分级才开启高分辨率模式。
+    """
+    if tier is None:
+        tier = VLM_IMAGE_TIER
+    # 构建图片路径格式
+    my_image_url = f"file://{os.path.abspath(prepare_image(my_image_path, tier))}"
+    amazon_image_url = f"file://{os.path.abspath(prepare_image(amazon_image_path, tier))}"
+
     messages = [
         {
             "role": "system",
@@ -168,25 +875,433 @@ def get_img_analyze(my_image_path, amazon_image_path):
         }
     ]
     
-    response = MultiModalConversation.call(
-        api_key=API_KEY,
-        model=MODEL_NAME,
-        messages=messages,
-        vl_high_resolution_images=True
+    return call_vision_model(messages, IMAGE_TIERS[tier] is None, streaming=VLM_STREAMING)
+
+class UploadCache:
+    """本地图片上传缓存：按模型和图片内容哈希记录DashScope临时存储中的oss://地址
+    
+    同一张图片（如我的产品图片）只上传一次，之后的比较直接引用远程地址；地址即将过期时重新上传。
+    多个线程同时需要同一张图片时只有一个线程上传，其他线程等待其结果。
+    新上传的地址只在内存中标记，由flush()在每个搜索词完成后和运行结束时统一写入缓存文件。
+    """
+    
+    def __init__(self, cache_file=UPLOAD_CACHE_FILE, policy_url=UPLOAD_POLICY_URL, ttl_seconds=UPLOAD_URL_TTL_SECONDS,
+                 refresh_margin_seconds=UPLOAD_URL_REFRESH_MARGIN_SECONDS, session=None, timeout=60):
+        self.cache_file = cache_file
+        self.policy_url = policy_url
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.stats = {
+            "uploads": 0,
+            "reuploads": 0,
+            "reused": 0,
+            "failed": 0,
+            "uploaded_bytes": 0,
+            "saved_bytes": 0,
+        }
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._inflight = {}
+        self._dirty = False
+        self._entries = self._load()
+    
+    def _load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取上传缓存失败: {e}")
+            return {}
+        # 丢弃已过期的地址
+        now = time.time()
+        return {key: entry for key, entry in entries.items() if entry.get("expires_at", 0) > now}
+    
+    def flush(self):
+        """有新上传的地址时把缓存写入文件，多个线程同时调用时依次写入"""
+        if not self.cache_file:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = dict(self._entries)
+                self._dirty = False
+            temp_file = f"{self.cache_file}.{threading.get_ident()}.tmp"
+            try:
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump(entries, f, ensure_ascii=False)
+                os.replace(temp_file, self.cache_file)
+            except OSError as e:
+                print(f"保存上传缓存失败: {e}")
+                with self._lock:
+                    self._dirty = True
+    
+    def _upload(self, file_path, digest):
+        """获取上传凭证后以表单方式上传到临时存储，返回oss://地址"""
+        response = self.session.get(
+            self.policy_url,
+            params={'action': 'getPolicy', 'model': MODEL_NAME},
+            headers={'Authorization': f'Bearer {API_KEY}'},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        policy = response.json()["data"]
+        # 以内容哈希命名，避免同名的不同图片互相覆盖
+        key = f"{policy['upload_dir']}/{digest}{os.path.splitext(file_path)[1].lower()}"
+        form_data = {
+            'OSSAccessKeyId': policy['oss_access_key_id'],
+            'Signature': policy['signature'],
+            'policy': policy['policy'],
+            'key': key,
+            'x-oss-object-acl': policy['x_oss_object_acl'],
+            'x-oss-forbid-overwrite': policy['x_oss_forbid_overwrite'],
+            'success_action_status': '200',
+        }
+        with open(file_path, 'rb') as f:
+            upload = self.session.post(policy['upload_host'], data=form_data, files={'file': f}, timeout=self.timeout)
+        upload.raise_for_status()
+        return f"oss://{key}"
+    
+    def remote_url(self, file_path):
+        """返回图片在临时存储中的地址，需要时上传；上传失败返回None"""
+        digest = file_sha256(file_path)
+        cache_key = f"{MODEL_NAME}:{digest}"
+        size = os.path.getsize(file_path)
+        while True:
+            with self._lock:
+                entry = self._entries.get(cache_key)
+                if entry and entry["expires_at"] - time.time() > self.refresh_margin_seconds:
+                    self.stats["reused"] += 1
+                    self.stats["saved_bytes"] += size
+                    METRICS.count('cache_lookups', cache='upload', result='hit')
+                    METRICS.count('upload_saved_bytes', size)
+                    return entry["url"]
+                event = self._inflight.get(cache_key)
+                if event is None:
+                    self._inflight[cache_key] = threading.Event()
+                    expired = entry is not None
+                    break
+            # 其他线程正在上传同一张图片
+            event.wait()
+            with self._lock:
+                if cache_key not in self._entries:
+                    return None
+        
+        METRICS.count('cache_lookups', cache='upload', result='miss')
+        try:
+            uploaded_at = time.time()
+            with METRICS.span('image_upload'):
+                url = self._upload(file_path, digest)
+            METRICS.count('upload_bytes', size)
+            with self._lock:
+                self._entries[cache_key] = {"url": url, "expires_at": uploaded_at + self.ttl_seconds, "size": size}
+                self.stats["uploads"] += 1
+                self.stats["reuploads"] += int(expired)
+                self.stats["uploaded_bytes"] += size
+                self._dirty = True
+            return url
+        except (requests.RequestException, OSError, ValueError, KeyError) as e:
+            print(f"上传图片 '{os.path.basename(file_path)}' 失败，改为随请求上传: {e}")
+            with self._lock:
+                self._entries.pop(cache_key, None)
+                self.stats["failed"] += 1
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(cache_key).set()
+    
+    def resolve_messages(self, messages):
+        """把消息中的file://图片替换为已上传的oss://地址，上传失败的图片保持不变"""
+        resolved = []
+        for message in messages:
+            content = []
+            for item in message["content"]:
+                if "image" in item and item["image"].startswith("file://"):
+                    url = self.remote_url(item["image"][len("file://"):])
+                    if url is not None:
+                        item = dict(item, image=url)
+                content.append(item)
+            resolved.append(dict(message, content=content))
+        return resolved
+    
+    def report(self):
+        """输出上传次数和节省的上传字节数"""
+        with self._lock:
+            stats = dict(self.stats)
+        if stats["uploads"] or stats["reused"] or stats["failed"]:
+            print(f"图片上传: 上传 {stats['uploads']} 次（其中过期重传 {stats['reuploads']} 次），"
+                  f"复用已上传地址 {stats['reused']} 次，失败 {stats['failed']} 次，"
+                  f"上传 {stats['uploaded_bytes'] / 1024 / 1024:.2f} MB，"
+                  f"节省上传 {stats['saved_bytes'] / 1024 / 1024:.2f} MB")
+        return stats
+
+UPLOAD_CACHE = UploadCache()
+
+class StreamingStats:
+    """统计流式比较从发出请求到得到结论的时间，以及提前结束节省的等待"""
+    
+    def __init__(self):
+        self.time_to_verdict = []
+        self.total_seconds = []
+        self.early_stops = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+    
+    def record(self, time_to_verdict, total_seconds, early_stop, output_tokens):
+        with self._lock:
+            if time_to_verdict is not None:
+                self.time_to_verdict.append(time_to_verdict)
+            self.total_seconds.append(total_seconds)
+            self.early_stops += int(early_stop)
+            self.output_tokens += output_tokens
+    
+    def report(self):
+        """输出结论延迟的平均值和P95，以及提前结束的次数"""
+        with self._lock:
+            verdict_times = sorted(self.time_to_verdict)
+            total_seconds = list(self.total_seconds)
+            early_stops, output_tokens = self.early_stops, self.output_tokens
+        if not total_seconds:
+            return {"calls": 0}
+        stats = {
+            "calls": len(total_seconds),
+            "early_stops": early_stops,
+            "avg_time_to_verdict": sum(verdict_times) / len(verdict_times) if verdict_times else None,
+            "p95_time_to_verdict": verdict_times[min(len(verdict_times) - 1, int(len(verdict_times) * 0.95))]
+            if verdict_times else None,
+            "avg_call_seconds": sum(total_seconds) / len(total_seconds),
+            "output_tokens": output_tokens,
+        }
+        if verdict_times:
+            print(f"流式比较: {stats['calls']} 次，提前结束 {early_stops} 次，"
+                  f"得到结论平均 {stats['avg_time_to_verdict']:.2f} 秒，P95 {stats['p95_time_to_verdict']:.2f} 秒，"
+                  f"每次调用平均 {stats['avg_call_seconds']:.2f} 秒，输出token共 {output_tokens}")
+        return stats
+
+STREAMING_STATS = StreamingStats()
+
+# 结论后面需要再出现一个非字母字符，才能确定结论不是更长单词的前缀
+VERDICT_PATTERN = re.compile(r'结论\s*[：:]\s*\**\s*(YES|NO)(?=[^A-Za-z])', re.IGNORECASE)
+
+def read_streaming_response(responses, keep_full_reasoning=None):
+    """逐段读取增量输出的流式回复，返回(回复文本, token用量)
+    
+    解析到结论后记录得到结论的时间；keep_full_reasoning为False时立即关闭流，
+    断开连接以停止生成剩余的理由，此时token用量中的truncated为True。
+    """
+    if keep_full_reasoning is None:
+        keep_full_reasoning = KEEP_FULL_REASONING
+    start_time = time.monotonic()
+    time_to_verdict = None
+    early_stop = False
+    chunks = []
+    usage = {}
+    try:
+        for response in responses:
+            check_dashscope_response(response)
+            usage = dict(response.get("usage") or usage)
+            content = response["output"]["choices"][0]["message"]["content"]
+            if content:
+                chunks.append(content[0].get("text", ""))
+            if time_to_verdict is None and VERDICT_PATTERN.search("".join(chunks)):
+                time_to_verdict = time.monotonic() - start_time
+                if not keep_full_reasoning:
+                    early_stop = True
+                    break
+    finally:
+        close = getattr(responses, 'close', None)
+        if close is not None:
+            close()
+    STREAMING_STATS.record(time_to_verdict, time.monotonic() - start_time, early_stop,
+                           usage.get("output_tokens", 0))
+    usage["truncated"] = early_stop
+    return "".join(chunks).strip(), usage
+
+def call_vision_model(messages, high_resolution, streaming=False):
+    """经过限流和重试调用视觉模型，返回(回复文本, token用量)
+    
+    streaming为True时使用增量流式输出，得到结论后即返回（见read_streaming_response）。
+    """
+    image_paths = [
+        item["image"][len("file://"):]
+        for message in messages
+        for item in message["content"]
+        if "image" in item and item["image"].startswith("file://")
+    ]
+    estimated_tokens = sum(estimate_image_tokens(path, high_resolution) for path in image_paths)
+    estimated_tokens += sum(len(item.get("text", "")) for message in messages for item in message["content"]) + 500
+    if UPLOAD_CACHE_ENABLED:
+        # 每张图片只上传一次，之后的调用引用临时存储中的地址
+        messages = UPLOAD_CACHE.resolve_messages(messages)
+
+    def call():
+        if streaming:
+            text, usage = read_streaming_response(MultiModalConversation.call(
+                api_key=API_KEY,
+                model=MODEL_NAME,
+                messages=messages,
+                vl_high_resolution_images=high_resolution,
+                stream=True,
+                incremental_output=True
+            ))
+            return (text, usage), usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+        
+        response = check_dashscope_response(MultiModalConversation.call(
+            api_key=API_KEY,
+            model=MODEL_NAME,
+            messages=messages,
+            vl_high_resolution_images=high_resolution
+        ))
+        usage = dict(response.get("usage") or {})
+        text = response["output"]["choices"][0]["message"]["content"][0]["text"].strip()
+        return (text, usage), usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+    
+    return VISION_API_CLIENT.call(
+        call, estimated_tokens=estimated_tokens,
+        span_name='vlm_call', span_labels={'mode': 'stream' if streaming else 'full', 'images': len(image_paths)}
     )
+
+def request_img_analysis(my_image_path, amazon_image_path, tier=None):
+    """调用视觉模型分析两张图片，返回模型的原始回复文本"""
+    return request_img_analysis_with_usage(my_image_path, amazon_image_path, tier)[0]
+
+def request_batch_img_analysis(my_image_path, candidate_paths, tier=None):
+    """在一次请求中比较我的产品图片与多张候选图片，返回(原始回复文本, token用量)"""
+    if tier is None:
+        tier = VLM_IMAGE_TIER
+    content = [{"image": f"file://{os.path.abspath(prepare_image(my_image_path, tier))}"}]
+    content += [
+        {"image": f"file://{os.path.abspath(prepare_image(candidate_path, tier))}"}
+        for candidate_path in candidate_paths
+    ]
+    content.append({"text": build_batch_image_prompt(len(candidate_paths))})
+    messages = [
+        {
+            "role": "system",
+            "content": [{"text": SYSTEM_PROMPT}]
+        },
+        {
+            "role": "user",
+            "content": content
+        }
+    ]
+    return call_vision_model(messages, IMAGE_TIERS[tier] is None)
+
+def get_img_analyze_batch(my_image_path, candidate_paths, tier=None):
+    """批量比较我的产品图片与一组候选图片，返回与candidate_paths对应的结论列表
+    
+    已缓存的候选不再发送；批量回复无法解析时退回逐对调用get_img_analyze。
+    批量得到的结论使用独立的缓存键保存，查找时优先使用逐对比较的结论。
+    """
+    if tier is None:
+        tier = VLM_IMAGE_TIER
+    conclusions = [None] * len(candidate_paths)
+    pending = []
+    for position, candidate_path in enumerate(candidate_paths):
+        cache_key = VERDICT_CACHE.make_key(my_image_path, candidate_path, tier, batched=True)
+        entry = VERDICT_CACHE.get(VERDICT_CACHE.make_key(my_image_path, candidate_path, tier), cache_key)
+        if entry is not None:
+            conclusions[position] = entry["conclusion"]
+        else:
+            pending.append((position, candidate_path, cache_key))
+    
+    if len(pending) == 1:
+        position, candidate_path, _ = pending[0]
+        conclusions[position] = get_img_analyze(my_image_path, candidate_path, tier)
+    elif pending:
+        raw_response = request_batch_img_analysis(my_image_path, [path for _, path, _ in pending], tier)[0]
+        verdicts = parse_batch_verdicts(raw_response, len(pending))
+        if verdicts is None:
+            print(f"批量比较回复格式异常，改为逐对比较 {len(pending)} 张图片")
+            for position, candidate_path, _ in pending:
+                conclusions[position] = get_img_analyze(my_image_path, candidate_path, tier)
+        else:
+            for (position, _, cache_key), verdict in zip(pending, verdicts):
+                VERDICT_CACHE.put(cache_key, raw_response, verdict)
+                conclusions[position] = verdict
+    return conclusions
+
+def get_img_analyze(my_image_path, amazon_image_path, tier=None):
+    """分析两张图片是否为竞品关系，优先使用缓存的判定结果"""
+    if tier is None:
+        tier = VLM_IMAGE_TIER
+    cache_key = VERDICT_CACHE.make_key(my_image_path, amazon_image_path, tier)
+    entry = VERDICT_CACHE.get(cache_key)
+    if entry is not None:
+        return entry["conclusion"]
     
-    return get_img_conclusion(response["output"]["choices"][0]["message"]["content"][0]["text"].strip())
+    raw_response, usage = request_img_analysis_with_usage(my_image_path, amazon_image_path, tier)
+    conclusion = get_img_conclusion(raw_response)
+    # 只缓存明确的结论，回复格式异常时下次重新分析
+    if conclusion in ('YES', 'NO'):
+        VERDICT_CACHE.put(cache_key, raw_response, conclusion, truncated=usage.get("truncated", False))
+    return conclusion
+
+def build_batch_image_prompt(candidate_count):
+    """构建批量比较提示词：沿用USER_PROMPT的判断标准，要求按候选顺序输出JSON数组"""
+    criteria = USER_PROMPT.split('输出格式如下')[0].rstrip()
+    return f"""{criteria}
+
+第1张图片是我的产品，之后的{candidate_count}张图片依次为候选商品1到候选商品{candidate_count}。
+请按上述标准分别判断每个候选商品与我的产品是否为竞品，只输出一个JSON数组，不要输出其他内容，格式如下：
+[{{"候选": 1, "结论": "YES/NO", "理由": "XXXXXX"}}, ...]
+数组中必须包含全部{candidate_count}个候选商品。"""
+
+def parse_batch_verdicts(content, expected_count):
+    """解析批量比较回复，返回按候选顺序排列的YES/NO列表，格式不正确时返回None
+    
+    优先解析JSON数组（允许包裹在代码块或其他文字中），失败时按"候选N ... 结论：YES"逐行匹配。
+    """
+    verdicts = {}
+    start = content.find('[')
+    end = content.rfind(']')
+    if start != -1 and end > start:
+        try:
+            items = json.loads(content[start:end + 1])
+        except ValueError:
+            items = None
+        if isinstance(items, list):
+            for position, item in enumerate(items, 1):
+                if not isinstance(item, dict):
+                    continue
+                try:
+                    index = int(item.get("候选", position))
+                except (TypeError, ValueError):
+                    continue
+                verdict = str(item.get("结论", "")).strip().upper()
+                if verdict in ('YES', 'NO'):
+                    verdicts.setdefault(index, verdict)
+    if len(verdicts) < expected_count:
+        for match in re.finditer(r'候选\D{0,4}(\d+)[^\n]*?结论\W{0,3}(YES|NO)', content, re.IGNORECASE):
+            verdicts.setdefault(int(match.group(1)), match.group(2).upper())
+    
+    if any(index not in verdicts for index in range(1, expected_count + 1)):
+        return None
+    return [verdicts[index] for index in range(1, expected_count + 1)]
+
+def normalize_conclusion(conclusion):
+    """去掉结论两侧的Markdown标记和标点，是YES/NO时统一为大写"""
+    stripped = conclusion.strip().strip('*_`"\'“”。.，,！!；; ').upper()
+    return stripped if stripped in ('YES', 'NO') else conclusion
 
 def get_img_conclusion(content):
     """从分析结果中提取结论"""
+    # 与流式读取使用同一个模式（末尾补换行，结论在回复末尾时也能匹配），"结论：**YES**"等写法也能识别
+    match = VERDICT_PATTERN.search(f"{content}\n")
+    if match:
+        return match.group(1).upper()
     try:
         lines = content.split('\n')
         for line in lines:
             if '结论：' in line or '结论:' in line:
                 conclusion = line.split('：')[-1].strip() if '：' in line else line.split(':')[-1].strip()
-                return conclusion
+                return normalize_conclusion(conclusion)
         # 如果找不到显式的结论行，尝试第一行
-        return content.split('\n')[0].split('：')[-1].strip() if '：' in content.split('\n')[0] else content.split('\n')[0].split(':')[-1].strip()
+        return normalize_conclusion(content.split('\n')[0].split('：')[-1].strip() if '：' in content.split('\n')[0] else content.split('\n')[0].split(':')[-1].strip())
     except:
         # 默认返回NO，以避免误判
         return 'NO'
@@ -216,121 +1331,955 @@ def calculate_similarity_level(competitor_count, total_count):
         return "低度相似"
 
 #####################################
-# 浏览器设置和管理
+# 竞品判定缓存
 #####################################
 
-def configure_chrome_options(headless=False, proxy=None, user_agent=None):
-    """配置Chrome浏览器选项"""
-    chrome_options = Options()
+_file_hash_cache = {}
+_file_hash_lock = threading.Lock()
+
+def file_sha256(file_path):
+    """计算文件内容的SHA256，文件未变化时复用上次的结果"""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _file_hash_lock:
+        if memo_key in _file_hash_cache:
+            return _file_hash_cache[memo_key]
     
-    # 设置用户代理
-    if user_agent is None:
-        user_agent = get_random_user_agent()
-    chrome_options.add_argument(f'user-agent={user_agent}')
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
     
-    # 如有请求，配置无头模式
-    if headless:
-        chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--window-size=1920,1080')
+    with _file_hash_lock:
+        _file_hash_cache[memo_key] = digest
+    return digest
+
+class VerdictCache:
+    """以两张图片的内容哈希、模型名和提示词哈希为键的磁盘判定缓存"""
     
-    # 如果提供了代理，则添加
-    if proxy:
-        chrome_options.add_argument(f'--proxy-server={proxy}')
+    def __init__(self, directory, max_age_days=None, max_size_mb=None):
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
     
-    # 其他使浏览器更稳定的选项
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--no-sandbox')
-    chrome_options.add_argument('--disable-dev-shm-usage')
-    chrome_options.add_argument('--disable-extensions')
-    chrome_options.add_argument('--disable-infobars')
-    chrome_options.add_argument('--disable-notifications')
-    chrome_options.add_argument('--disable-popup-blocking')
-    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    def make_key(self, my_image_path, amazon_image_path, tier=None, batched=False):
+        """生成缓存键，模型、提示词或图片预处理分级变化都会得到新的键
+        
+        原图分级不加入键中，因此引入分级之前缓存的结果仍然有效；批量比较的结论使用单独的键。
+        """
+        if tier is None:
+            tier = VLM_IMAGE_TIER
+        prompt_hash = hashlib.sha256(f"{SYSTEM_PROMPT}\n{USER_PROMPT}".encode('utf-8')).hexdigest()
+        key_parts = [
+            file_sha256(my_image_path),
+            file_sha256(amazon_image_path),
+            MODEL_NAME,
+            prompt_hash
+        ]
+        if IMAGE_TIERS[tier] is not None:
+            key_parts.append(f"{tier}:{json.dumps(IMAGE_TIERS[tier], sort_keys=True)}")
+        if batched:
+            key_parts.append("batch")
+        raw_key = "|".join(key_parts)
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
     
-    # 防止自动化检测
-    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    chrome_options.add_experimental_option('useAutomationExtension', False)
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
     
-    return chrome_options
-
-@contextmanager
-def create_driver(headless=False, proxy=None, user_agent=None, window_size=(1366, 768)):
-    """创建并管理Chrome WebDriver，确保适当的设置和清理"""
-    driver = None
-    try:
-        # 配置并创建驱动程序
-        options = configure_chrome_options(headless, proxy, user_agent)
-        driver = webdriver.Chrome(options=options)
+    def _is_expired(self, created_at):
+        if not self.max_age_days:
+            return False
+        return time.time() - created_at > self.max_age_days * 86400
+    
+    def _read(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            if self._is_expired(entry.get("created_at", 0)):
+                return None
+            # 更新访问时间，供按大小淘汰时参考
+            os.utime(entry_path, None)
+            return entry
+        except (OSError, ValueError):
+            return None
+    
+    def peek(self, *keys):
+        """按顺序读取第一个存在的缓存条目，不计入命中统计
         
-        # 设置窗口大小
-        driver.set_window_size(*window_size)
+        KEEP_FULL_REASONING开启时跳过理由被截断的条目，使审计运行重新获取完整回复。
+        """
+        for key in keys:
+            entry = self._read(key)
+            if entry is not None and not (KEEP_FULL_REASONING and entry.get("truncated")):
+                return entry
+        return None
+    
+    def get(self, *keys):
+        """按顺序读取第一个存在的缓存条目，都不存在或已过期时返回None"""
+        entry = self.peek(*keys)
         
-        # 执行CDP命令以防止检测
-        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
-            'source': '''
-                Object.defineProperty(navigator, 'webdriver', {
-                    get: () => undefined
-                });
-                
-                // 重写'plugins'属性以使用自定义getter
-                Object.defineProperty(navigator, 'plugins', {
-                    get: () => [1, 2, 3, 4, 5],
-                });
-                
-                // 重写'languages'属性以使用自定义getter
-                Object.defineProperty(navigator, 'languages', {
-                    get: () => ['en-US', 'en', 'zh-CN'],
-                });
-            '''
-        })
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        METRICS.count('cache_lookups', cache='verdict', result='miss' if entry is None else 'hit')
+        return entry
+    
+    def put(self, key, raw_response, conclusion, truncated=False):
+        """写入缓存条目（先写临时文件再替换，避免中断时留下损坏的条目）
         
-        yield driver
-    finally:
-        # 确保驱动程序最终被关闭
-        if driver:
-            driver.quit()
-
-#####################################
-# 元素交互辅助函数
+        truncated表示流式比较得到结论后提前结束，raw_response中没有完整的理由。
+        """
+        entry_path = self._entry_path(key)
+        entry = {
+            "model": MODEL_NAME,
+            "conclusion": conclusion,
+            "raw_response": raw_response,
+            "created_at": time.time()
+        }
+        if truncated:
+            entry["truncated"] = True
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            temp_path = f"{entry_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+                # 刷盘后再替换，条目同时充当中断恢复的记录
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, entry_path)
+        except OSError as e:
+            print(f"写入判定缓存失败: {e}")
+    
+    def _read_created_at(self, entry_path):
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("created_at", 0)
+        except (OSError, ValueError):
+            return 0
+    
+    def evict(self):
+        """删除过期条目，并在超出大小上限时按最近访问时间淘汰旧条目"""
+        if not os.path.isdir(self.directory):
+            return 0
+        
+        entries = []
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                entry_path = os.path.join(root, file)
+                # 清理未完成写入的临时文件和过期条目
+                if file.endswith('.json') and not self._is_expired(self._read_created_at(entry_path)):
+                    try:
+                        stat = os.stat(entry_path)
+                        entries.append((stat.st_mtime, stat.st_size, entry_path))
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    os.remove(entry_path)
+                    removed += 1
+                except OSError:
+                    pass
+        
+        if self.max_size_mb:
+            max_bytes = self.max_size_mb * 1024 * 1024
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, entry_path in sorted(entries):
+                if total_bytes <= max_bytes:
+                    break
+                try:
+                    os.remove(entry_path)
+                    total_bytes -= size
+                    removed += 1
+                except OSError:
+                    pass
+        
+        if removed:
+            print(f"判定缓存已淘汰 {removed} 个条目")
+        return removed
+    
+    def report(self):
+        """输出缓存命中统计"""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        hit_rate = hits / total * 100 if total else 0
+        print(f"判定缓存: 命中 {hits} 次，未命中 {misses} 次，命中率 {hit_rate:.1f}%")
+        return {"hits": hits, "misses": misses}
+
+VERDICT_CACHE = VerdictCache(
+    VERDICT_CACHE_DIRECTORY,
+    max_age_days=VERDICT_CACHE_MAX_AGE_DAYS,
+    max_size_mb=VERDICT_CACHE_MAX_SIZE_MB
+)
+
+#####################################
+# 图片校验与近似去重
 #####################################
 
-def safe_find_element(driver, locator_strategies, wait_time=10, parent_element=None):
-    """使用多种定位策略安全地查找元素"""
-    for by, selector in locator_strategies:
-        try:
-            if parent_element:
-                # 如果有父元素，直接在其中搜索
-                return parent_element.find_element(by, selector)
-            else:
-                # 否则使用wait在整个页面中查找元素
-                element = WebDriverWait(driver, wait_time).until(
-                    EC.presence_of_element_located((by, selector))
-                )
-                return element
-        except (TimeoutException, NoSuchElementException, StaleElementReferenceException):
+def inspect_image(image_path, hash_size=8):
+    """打开一次图片完成校验并计算感知哈希，返回(是否有效, 原因, 哈希, 像素面积)
+    
+    load()会完整解码图片，损坏或截断的文件在此时抛出异常。
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.load()
+            width, height = img.size
+            if width < MIN_IMAGE_SIDE or height < MIN_IMAGE_SIDE:
+                return False, f"尺寸过小 ({width}x{height})", None, 0
+            gray = img.convert('L')
+    except Exception as e:
+        return False, f"无法解析图片: {e}", None, 0
+    
+    if ImageStat.Stat(gray).stddev[0] < PLACEHOLDER_MAX_STDDEV:
+        return False, "纯色占位图", None, 0
+    return True, None, dhash(gray, hash_size), width * height
+
+def dhash(gray_image, hash_size=8):
+    """计算灰度图片的差值感知哈希(dHash)"""
+    pixels = list(gray_image.resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+    
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+def collapse_near_duplicates(image_files, threshold=DEDUP_HAMMING_THRESHOLD):
+    """校验图片并将近似相同的图片分组，返回(分组列表, 无效图片字典)
+    
+    每个分组的第一个文件是代表图片（分辨率最高者），只有代表图片需要发送给模型。
+    无效图片（占位图、损坏文件）不参与分析，也不计入总商品数。
+    """
+    invalid_files = {}
+    candidates = []
+    for image_file in sorted(image_files):
+        is_valid, reason, image_hash, area = inspect_image(image_file)
+        if not is_valid:
+            invalid_files[image_file] = reason
             continue
-    return None
+        candidates.append((image_file, image_hash, area))
+    
+    groups = []
+    for image_file, image_hash, area in candidates:
+        for group in groups:
+            if bin(group["hash"] ^ image_hash).count('1') <= threshold:
+                group["members"].append((image_file, area))
+                break
+        else:
+            groups.append({"hash": image_hash, "members": [(image_file, area)]})
+    
+    # 每组选分辨率最高的图片作为代表，面积相同时按文件名排序
+    grouped_files = []
+    for group in groups:
+        members = sorted(group["members"], key=lambda member: (-member[1], member[0]))
+        grouped_files.append([image_file for image_file, _ in members])
+    
+    saved_calls = len(candidates) - len(grouped_files)
+    print(f"图片去重: 有效 {len(candidates)} 张，无效 {len(invalid_files)} 张，"
+          f"分为 {len(grouped_files)} 组，节省 {saved_calls + len(invalid_files)} 次模型调用")
+    for image_file, reason in invalid_files.items():
+        print(f"跳过无效图片 '{os.path.basename(image_file)}': {reason}")
+    return grouped_files, invalid_files
+
+#####################################
+# 图片预处理分级
+#####################################
+
+def prepare_image(image_path, tier=None):
+    """返回图片在指定分级下发送给模型的文件路径
+    
+    派生图片保存在DERIVED_IMAGE_DIRECTORY/<分级>/下并以原图内容哈希命名，同一张图片只处理一次；
+    原图已经是不超过该分级边长的JPEG时直接使用原图。
+    """
+    if tier is None:
+        tier = VLM_IMAGE_TIER
+    spec = IMAGE_TIERS[tier]
+    if spec is None:
+        return image_path
+    
+    digest = file_sha256(image_path)
+    derived_path = os.path.join(DERIVED_IMAGE_DIRECTORY, tier, digest[:2], f"{digest}.jpg")
+    if os.path.exists(derived_path):
+        return derived_path
+    
+    with Image.open(image_path) as img:
+        if img.format == 'JPEG' and max(img.size) <= spec["max_side"]:
+            return image_path
+        if img.mode in ('RGBA', 'LA') or 'transparency' in img.info:
+            # 透明背景填充为白色，避免转换后变成黑色
+            rgba = img.convert('RGBA')
+            converted = Image.new('RGB', rgba.size, (255, 255, 255))
+            converted.paste(rgba, mask=rgba.split()[-1])
+        else:
+            converted = img.convert('RGB')
+    converted.thumbnail((spec["max_side"], spec["max_side"]), Image.LANCZOS)
+    
+    os.makedirs(os.path.dirname(derived_path), exist_ok=True)
+    temp_path = f"{derived_path}.{threading.get_ident()}.tmp"
+    converted.save(temp_path, 'JPEG', quality=spec["quality"], optimize=True)
+    os.replace(temp_path, derived_path)
+    return derived_path
+
+def sample_benchmark_pairs(sample_size, my_product_index=None, amazon_directory=None):
+    """从已下载的图片中轮流抽取各搜索词的(我的产品图片, 亚马逊图片)对，结果是确定的"""
+    if my_product_index is None:
+        my_product_index = build_my_product_index()
+    if amazon_directory is None:
+        amazon_directory = AMAZON_IMAGE_DIRECTORY
+    candidates = []
+    for product_name, my_product_file in sorted(my_product_index.items()):
+        amazon_files = sorted(list_amazon_images(os.path.join(amazon_directory, product_name)))
+        if amazon_files:
+            candidates.append((my_product_file, amazon_files))
+    
+    pairs = []
+    index = 0
+    while len(pairs) < sample_size and any(index < len(files) for _, files in candidates):
+        for my_product_file, amazon_files in candidates:
+            if index < len(amazon_files) and len(pairs) < sample_size:
+                pairs.append((my_product_file, amazon_files[index]))
+        index += 1
+    return pairs
+
+def benchmark_image_tiers(pairs, tiers=None, reference_tier='full'):
+    """用同一批图片对逐个分级调用视觉模型（不读写判定缓存），比较延迟、token用量、载荷大小和结论一致率
+    
+    一致率以reference_tier的结论为准，只统计两个分级都得到明确结论的图片对。
+    """
+    tiers = list(tiers or IMAGE_TIERS)
+    if reference_tier not in tiers:
+        tiers.insert(0, reference_tier)
+    
+    verdicts = {}
+    report = {}
+    for tier in tiers:
+        latencies = []
+        input_tokens = output_tokens = payload_bytes = errors = 0
+        verdicts[tier] = []
+        for my_image_path, amazon_image_path in pairs:
+            payload_bytes += sum(
+                os.path.getsize(prepare_image(path, tier)) for path in (my_image_path, amazon_image_path)
+            )
+            start_time = time.time()
+            try:
+                text, usage = request_img_analysis_with_usage(my_image_path, amazon_image_path, tier)
+            except Exception as e:
+                print(f"分级 {tier} 分析 '{os.path.basename(amazon_image_path)}' 出错: {e}")
+                errors += 1
+                verdicts[tier].append(None)
+                continue
+            latencies.append(time.time() - start_time)
+            input_tokens += usage.get("input_tokens", 0)
+            output_tokens += usage.get("output_tokens", 0)
+            verdicts[tier].append(get_img_conclusion(text))
+        
+        latencies.sort()
+        report[tier] = {
+            "pairs": len(pairs),
+            "errors": errors,
+            "avg_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p95_latency": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+            "avg_input_tokens": input_tokens / len(latencies) if latencies else 0.0,
+            "avg_output_tokens": output_tokens / len(latencies) if latencies else 0.0,
+            "avg_payload_kb": payload_bytes / 1024 / len(pairs) if pairs else 0.0,
+        }
+    
+    for tier in tiers:
+        compared = [
+            (verdict, reference)
+            for verdict, reference in zip(verdicts[tier], verdicts[reference_tier])
+            if verdict in ('YES', 'NO') and reference in ('YES', 'NO')
+        ]
+        agreed = sum(1 for verdict, reference in compared if verdict == reference)
+        report[tier]["agreement"] = agreed / len(compared) if compared else None
+    
+    print(f"图片分级基准测试 ({len(pairs)} 对图片，以 {reference_tier} 分级的结论为准):")
+    for tier, stats in report.items():
+        agreement = f"{stats['agreement'] * 100:.1f}%" if stats["agreement"] is not None else "-"
+        print(f"  {tier}: 平均延迟 {stats['avg_latency']:.2f} 秒，P95延迟 {stats['p95_latency']:.2f} 秒，"
+              f"平均输入token {stats['avg_input_tokens']:.0f}，平均输出token {stats['avg_output_tokens']:.0f}，"
+              f"平均载荷 {stats['avg_payload_kb']:.1f} KB，结论一致率 {agreement}，错误 {stats['errors']} 次")
+    return report
+
+#####################################
+# 本地视觉相似度
+#####################################
+
+_visual_feature_cache = {}
+_visual_feature_lock = threading.Lock()
+
+def _normalize_feature(vector):
+    """去均值后归一化为单位向量，两个特征的点积即为皮尔逊相关系数"""
+    vector = vector.astype(np.float32).ravel()
+    vector = vector - vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+def extract_visual_features(image_path, size=VISUAL_FEATURE_SIZE):
+    """提取图片的颜色、边缘和缩略图特征，返回{特征名: 单位向量}，按图片内容哈希缓存在内存中
+    
+    color为HSV颜色直方图(8x4x4)，edge为4x4网格内按梯度幅值加权的8方向边缘直方图，
+    thumbnail为16x16灰度缩略图。直方图先开平方，避免背景色等少数大计数的桶主导相关系数。
+    """
+    digest = file_sha256(image_path)
+    with _visual_feature_lock:
+        if digest in _visual_feature_cache:
+            return _visual_feature_cache[digest]
+    
+    with Image.open(image_path) as img:
+        if img.mode in ('RGBA', 'LA') or 'transparency' in img.info:
+            # 透明背景按白色处理，与发送给模型的图片一致
+            rgba = img.convert('RGBA')
+            rgb = Image.new('RGB', rgba.size, (255, 255, 255))
+            rgb.paste(rgba, mask=rgba.split()[-1])
+        else:
+            rgb = img.convert('RGB')
+    rgb = rgb.resize((size, size), Image.BILINEAR)
+    
+    hsv = np.asarray(rgb.convert('HSV'), dtype=np.int32)
+    bins = (hsv[..., 0] * 8 // 256) * 16 + (hsv[..., 1] * 4 // 256) * 4 + hsv[..., 2] * 4 // 256
+    color = np.bincount(bins.ravel(), minlength=128)
+    
+    gray = np.asarray(rgb.convert('L'), dtype=np.float32)
+    grad_y, grad_x = np.gradient(gray)
+    magnitude = np.hypot(grad_x, grad_y)
+    orientation = ((np.arctan2(grad_y, grad_x) % np.pi) / np.pi * 8).astype(np.int32) % 8
+    cell = size // 4
+    cell_index = (np.arange(size) // cell).clip(0, 3)
+    spatial = cell_index[:, None] * 4 + cell_index[None, :]
+    edge = np.bincount((spatial * 8 + orientation).ravel(), weights=magnitude.ravel(), minlength=128)
+    
+    thumbnail = np.asarray(rgb.convert('L').resize((16, 16), Image.BILINEAR), dtype=np.float32)
+    
+    features = {
+        'color': _normalize_feature(np.sqrt(color)),
+        'edge': _normalize_feature(np.sqrt(edge)),
+        'thumbnail': _normalize_feature(thumbnail),
+    }
+    with _visual_feature_lock:
+        _visual_feature_cache[digest] = features
+    return features
+
+def score_visual_similarity(my_image_path, candidate_paths, weights=None):
+    """计算我的产品图片与每张候选图片的加权相似度，返回与candidate_paths对应的numpy数组
+    
+    每种特征的所有候选向量堆成一个矩阵，与我的产品向量做一次矩阵乘法得到全部相关系数。
+    """
+    if weights is None:
+        weights = VISUAL_FEATURE_WEIGHTS
+    if not candidate_paths:
+        return np.zeros(0, dtype=np.float32)
+    my_features = extract_visual_features(my_image_path)
+    candidate_features = [extract_visual_features(path) for path in candidate_paths]
+    total_weight = sum(weights.values())
+    scores = np.zeros(len(candidate_paths), dtype=np.float32)
+    for name, weight in weights.items():
+        matrix = np.stack([features[name] for features in candidate_features])
+        scores += weight * (matrix @ my_features[name])
+    return scores / total_weight if total_weight else scores
+
+def visual_agreement_report(pairs, floors=None):
+    """对照判定缓存中已有的视觉模型结论，评估不同相似度阈值下本地预筛选的剪枝效果
+    
+    只统计缓存中有明确结论的图片对（不调用模型）。对每个阈值输出被剪掉的比例，
+    以及被剪掉的候选中模型判定为YES的数量（即预筛选会漏掉的竞品）。
+    """
+    if floors is None:
+        floors = sorted({0.0, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, VISUAL_SIMILARITY_FLOOR})
+    labelled = []
+    for my_image_path, amazon_image_path in pairs:
+        entry = VERDICT_CACHE.peek(
+            VERDICT_CACHE.make_key(my_image_path, amazon_image_path),
+            VERDICT_CACHE.make_key(my_image_path, amazon_image_path, batched=True)
+        )
+        if entry is not None and entry["conclusion"] in ('YES', 'NO'):
+            labelled.append((my_image_path, amazon_image_path, entry["conclusion"]))
+    if not labelled:
+        print("判定缓存中没有这些图片对的模型结论，无法评估视觉预筛选")
+        return {}
+    
+    # 同一张我的产品图片的候选一起打分
+    by_product = {}
+    for position, (my_image_path, amazon_image_path, _) in enumerate(labelled):
+        by_product.setdefault(my_image_path, []).append((position, amazon_image_path))
+    scores = np.zeros(len(labelled), dtype=np.float32)
+    for my_image_path, candidates in by_product.items():
+        positions = [position for position, _ in candidates]
+        scores[positions] = score_visual_similarity(my_image_path, [path for _, path in candidates])
+    is_yes = np.array([conclusion == 'YES' for _, _, conclusion in labelled])
+    
+    yes_count = int(is_yes.sum())
+    print(f"视觉预筛选一致性 ({len(labelled)} 对有缓存结论的图片，模型判定YES {yes_count} 对):")
+    lowest_yes = f"{scores[is_yes].min():.3f}" if yes_count else "-"
+    highest_no = f"{scores[~is_yes].max():.3f}" if yes_count < len(labelled) else "-"
+    print(f"  模型判定YES的相似度最低 {lowest_yes}，判定NO的相似度最高 {highest_no}")
+    report = {}
+    for floor in floors:
+        pruned = scores < floor
+        missed = int((pruned & is_yes).sum())
+        report[floor] = {
+            "pruned": int(pruned.sum()),
+            "pruned_ratio": float(pruned.mean()),
+            "missed_competitors": missed,
+            "recall": 1 - missed / yes_count if yes_count else None,
+        }
+        recall = f"{report[floor]['recall'] * 100:.1f}%" if yes_count else "-"
+        marker = " (当前)" if floor == VISUAL_SIMILARITY_FLOOR else ""
+        print(f"  阈值 {floor:.2f}{marker}: 剪掉 {report[floor]['pruned']} 对 ({report[floor]['pruned_ratio'] * 100:.1f}%)，"
+              f"漏掉竞品 {missed} 对，竞品召回率 {recall}")
+    return report
+
+#####################################
+# 浏览器设置和管理
+#####################################
+
+def configure_chrome_options(headless=False, proxy=None, user_agent=None):
+    """配置Chrome浏览器选项"""
+    chrome_options = Options()
+    
+    # 设置用户代理
+    if user_agent is None:
+        user_agent = get_random_user_agent()
+    chrome_options.add_argument(f'user-agent={user_agent}')
+    
+    # 如有请求，配置无头模式
+    if headless:
+        chrome_options.add_argument('--headless')
+        chrome_options.add_argument('--window-size=1920,1080')
+    
+    # 如果提供了代理，则添加
+    if proxy:
+        chrome_options.add_argument(f'--proxy-server={proxy}')
+    
+    # 其他使浏览器更稳定的选项
+    chrome_options.add_argument('--disable-gpu')
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    chrome_options.add_argument('--disable-extensions')
+    chrome_options.add_argument('--disable-infobars')
+    chrome_options.add_argument('--disable-notifications')
+    chrome_options.add_argument('--disable-popup-blocking')
+    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    
+    # 防止自动化检测
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    
+    # 开启性能日志，通过其中的CDP网络事件判断网络是否空闲
+    chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    
+    return chrome_options
 
-def safe_find_elements(driver, locator_strategies, wait_time=10, parent_element=None):
-    """使用多种定位策略安全地查找多个元素"""
-    for by, selector in locator_strategies:
+def start_driver(headless=False, proxy=None, user_agent=None, window_size=(1366, 768)):
+    """创建并配置Chrome WebDriver，调用方负责关闭"""
+    # 配置并创建驱动程序
+    options = configure_chrome_options(headless, proxy, user_agent)
+    startup_time = time.perf_counter()
+    driver = webdriver.Chrome(options=options)
+    try:
+        # 设置窗口大小
+        driver.set_window_size(*window_size)
+        
+        # 执行CDP命令以防止检测
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
+            'source': '''
+                Object.defineProperty(navigator, 'webdriver', {
+                    get: () => undefined
+                });
+                
+                // 重写'plugins'属性以使用自定义getter
+                Object.defineProperty(navigator, 'plugins', {
+                    get: () => [1, 2, 3, 4, 5],
+                });
+                
+                // 重写'languages'属性以使用自定义getter
+                Object.defineProperty(navigator, 'languages', {
+                    get: () => ['en-US', 'en', 'zh-CN'],
+                });
+            '''
+        })
+    except Exception:
+        driver.quit()
+        raise
+    METRICS.observe('browser_startup', time.perf_counter() - startup_time)
+    return driver
+
+@contextmanager
+def create_driver(headless=False, proxy=None, user_agent=None, window_size=(1366, 768)):
+    """创建并管理Chrome WebDriver，确保适当的设置和清理"""
+    driver = None
+    try:
+        driver = start_driver(headless, proxy, user_agent, window_size)
+        yield driver
+    finally:
+        # 确保驱动程序最终被关闭
+        if driver:
+            driver.quit()
+
+class BrowserSessionError(Exception):
+    """浏览器会话无法打开亚马逊网站"""
+
+class BrowserPool:
+    """可复用的WebDriver会话池，会话在多次搜索之间保持停留在亚马逊网站
+    
+    会话在使用前进行健康检查，达到最大使用次数或发生WebDriver错误后重新创建。
+    池记录所有已创建的会话（包括借出中的），关闭时全部退出。
+    """
+    
+    def __init__(self, size=BROWSER_POOL_SIZE, max_uses=BROWSER_MAX_USES, headless=BROWSER_HEADLESS,
+                 proxy=None, url="https://www.amazon.com"):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.headless = headless
+        self.proxy = proxy
+        self.url = url
+        self.created = 0
+        self.recycled = 0
+        self._idle = queue.Queue()
+        self._open_count = 0
+        self._sessions = []
+        self._closed = False
+        self._lock = threading.Lock()
+    
+    def _create_session(self):
+        """启动新的浏览器并打开亚马逊首页"""
+        driver = start_driver(headless=self.headless, proxy=self.proxy)
+        if not open_amazon(driver, self.url):
+            driver.quit()
+            raise BrowserSessionError("打开亚马逊网站失败")
+        session = {"driver": driver, "uses": 0}
+        with self._lock:
+            self.created += 1
+            closed = self._closed
+            if not closed:
+                self._sessions.append(session)
+        if closed:
+            # 创建期间池已被关闭
+            driver.quit()
+            raise BrowserSessionError("浏览器会话池已关闭")
+        print("浏览器成功初始化")
+        return session
+    
+    def _is_healthy(self, session):
+        """检查会话是否仍可用且停留在亚马逊网站"""
         try:
-            if parent_element:
-                # 如果有父元素，直接在其中搜索
-                elements = parent_element.find_elements(by, selector)
-                if elements:
-                    return elements
-            else:
-                # 否则使用wait在整个页面中查找至少一个元素
-                WebDriverWait(driver, wait_time).until(
-                    EC.presence_of_element_located((by, selector))
-                )
-                elements = driver.find_elements(by, selector)
+            driver = session["driver"]
+            driver.execute_script('return document.readyState')
+            return 'amazon' in driver.current_url.lower()
+        except Exception:
+            return False
+    
+    def _discard(self, session):
+        """关闭会话并释放其在池中占用的名额"""
+        with self._lock:
+            if session not in self._sessions:
+                # 已在关闭池时退出
+                return
+            self._sessions.remove(session)
+            self._open_count -= 1
+            self.recycled += 1
+        try:
+            session["driver"].quit()
+        except Exception:
+            pass
+    
+    def _acquire(self):
+        """取出空闲会话，池未满时创建新会话，否则等待其他会话归还"""
+        while True:
+            if self._closed:
+                raise BrowserSessionError("浏览器会话池已关闭")
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._open_count < self.size
+                    if can_create:
+                        self._open_count += 1
+                if not can_create:
+                    try:
+                        session = self._idle.get(timeout=1)
+                    except queue.Empty:
+                        continue
+                else:
+                    try:
+                        return self._create_session()
+                    except Exception:
+                        with self._lock:
+                            self._open_count -= 1
+                        raise
+            
+            if self._is_healthy(session):
+                return session
+            print("浏览器会话不可用，重新创建")
+            self._discard(session)
+    
+    @contextmanager
+    def session(self):
+        """借出一个停留在亚马逊网站的WebDriver，使用完毕后归还到池中"""
+        session = self._acquire()
+        try:
+            yield session["driver"]
+        except WebDriverException:
+            # 浏览器崩溃或连接断开，不再复用该会话
+            self._discard(session)
+            raise
+        except BaseException:
+            self._release(session)
+            raise
+        else:
+            self._release(session)
+    
+    def _release(self, session):
+        session["uses"] += 1
+        if self._closed or (self.max_uses and session["uses"] >= self.max_uses):
+            self._discard(session)
+        else:
+            self._idle.put(session)
+    
+    def close(self):
+        """关闭池中所有会话，包括仍被借出的会话，之后不能再借出会话"""
+        with self._lock:
+            self._closed = True
+            sessions, self._sessions = self._sessions, []
+            self._open_count -= len(sessions)
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+        for session in sessions:
+            try:
+                session["driver"].quit()
+            except Exception:
+                pass
+        print(f"浏览器会话池已关闭 (共创建 {self.created} 个会话)")
+
+#####################################
+# 页面等待与节奏控制
+#####################################
+
+class PacingStats:
+    """分别统计刻意的反爬虫停顿和等待页面真实加载所花的时间"""
+    
+    def __init__(self):
+        self.pauses = {}
+        self.loads = {}
+        self._lock = threading.Lock()
+    
+    def _record(self, bucket, name, seconds):
+        with self._lock:
+            count, total = bucket.get(name, (0, 0.0))
+            bucket[name] = (count + 1, total + seconds)
+    
+    def record_pause(self, reason, seconds):
+        self._record(self.pauses, reason, seconds)
+    
+    def record_load(self, kind, seconds):
+        self._record(self.loads, kind, seconds)
+    
+    def report(self):
+        """输出停顿与页面加载的耗时及占比"""
+        with self._lock:
+            pauses, loads = dict(self.pauses), dict(self.loads)
+        pause_total = sum(total for _, total in pauses.values())
+        load_total = sum(total for _, total in loads.values())
+        if not pauses and not loads:
+            return {"pause_seconds": 0.0, "load_seconds": 0.0}
+        overall = pause_total + load_total
+        print(f"页面节奏: 刻意停顿 {pause_total:.1f} 秒 ({pause_total / overall * 100 if overall else 0:.0f}%)，"
+              f"等待页面加载 {load_total:.1f} 秒")
+        for label, bucket in (("停顿", pauses), ("加载", loads)):
+            for name, (count, total) in sorted(bucket.items()):
+                print(f"  {label} {name}: {count} 次，共 {total:.1f} 秒，平均 {total / count:.2f} 秒")
+        return {"pause_seconds": pause_total, "load_seconds": load_total, "pauses": pauses, "loads": loads}
+
+PACING_STATS = PacingStats()
+
+def pace(reason):
+    """按PACING_POLICY执行一次随机停顿，模拟人工操作的节奏，返回停顿的秒数"""
+    interval = PACING_POLICY.get(reason)
+    if not PACING_ENABLED or not interval:
+        return 0.0
+    sleep_time = random.uniform(*interval)
+    time.sleep(sleep_time)
+    PACING_STATS.record_pause(reason, sleep_time)
+    METRICS.observe('pacing_pause', sleep_time, reason=reason)
+    return sleep_time
+
+def wait_for_network_idle(driver, idle_seconds=None, timeout=None, max_inflight=None):
+    """根据性能日志中的CDP网络事件等待网络空闲，无法读取性能日志时改为观察资源加载数量"""
+    if idle_seconds is None:
+        idle_seconds = NETWORK_IDLE_SECONDS
+    if timeout is None:
+        timeout = PAGE_READY_TIMEOUT
+    if max_inflight is None:
+        max_inflight = NETWORK_IDLE_MAX_INFLIGHT
+    deadline = time.monotonic() + timeout
+    last_activity = time.monotonic()
+    inflight = set()
+    use_performance_log = True
+    resource_count = -1
+    
+    while time.monotonic() < deadline:
+        activity = False
+        if use_performance_log:
+            try:
+                entries = driver.get_log('performance')
+            except Exception:
+                use_performance_log = False
+                continue
+            for entry in entries:
+                try:
+                    message = json.loads(entry["message"])["message"]
+                except (KeyError, ValueError, TypeError):
+                    continue
+                method = message.get("method", "")
+                request_id = message.get("params", {}).get("requestId")
+                if method == 'Network.requestWillBeSent':
+                    inflight.add(request_id)
+                    activity = True
+                elif method in ('Network.loadingFinished', 'Network.loadingFailed'):
+                    inflight.discard(request_id)
+                    activity = True
+        else:
+            try:
+                count = driver.execute_script("return performance.getEntriesByType('resource').length")
+            except Exception:
+                return False
+            activity = count != resource_count
+            resource_count = count
+        
+        now = time.monotonic()
+        if activity:
+            last_activity = now
+        elif len(inflight) <= max_inflight and now - last_activity >= idle_seconds:
+            return True
+        time.sleep(0.1)
+    return False
+
+def wait_for_page_ready(driver, kind, ready_locators=None, timeout=None):
+    """等待页面真正可用：DOM加载完成、就绪元素出现（任一定位策略匹配即可）且网络空闲
+    
+    kind用于统计不同页面的加载耗时，返回就绪元素是否出现（未提供ready_locators时返回True）。
+    """
+    if timeout is None:
+        timeout = PAGE_READY_TIMEOUT
+    start_time = time.monotonic()
+    wait_for_page_load(driver, timeout)
+    ready = True
+    if ready_locators:
+        remaining = max(0.1, timeout - (time.monotonic() - start_time))
+        ready = bool(safe_find_elements(driver, ready_locators, remaining, page_type=kind))
+    if ready:
+        wait_for_network_idle(driver, timeout=max(0.1, timeout - (time.monotonic() - start_time)))
+    PACING_STATS.record_load(kind, time.monotonic() - start_time)
+    METRICS.observe('page_load', time.monotonic() - start_time, error=not ready, page=kind)
+    return ready
+
+#####################################
+# 元素交互辅助函数
+#####################################
+
+class LocatorEngine:
+    """多定位策略的元素查找：所有策略共用一个截止时间，每次轮询依次尝试全部策略
+    
+    按页面类型和策略列表记住上次命中的策略，下次优先尝试；记录每类查找的耗时和命中情况。
+    """
+    
+    def __init__(self, poll_frequency=0.2):
+        self.poll_frequency = poll_frequency
+        self._winners = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+    
+    def _ordered(self, memory_key, locator_strategies):
+        with self._lock:
+            winner = self._winners.get(memory_key)
+        if winner is None:
+            return list(locator_strategies)
+        return [winner] + [strategy for strategy in locator_strategies if strategy != winner]
+    
+    def _record(self, page_type, memory_key, winner, latency, first_choice):
+        METRICS.observe('element_lookup', latency, error=winner is None, page=page_type)
+        with self._lock:
+            stats = self._stats.setdefault(page_type, {
+                "lookups": 0, "found": 0, "first_choice_hits": 0, "seconds": 0.0, "max_seconds": 0.0
+            })
+            stats["lookups"] += 1
+            stats["seconds"] += latency
+            stats["max_seconds"] = max(stats["max_seconds"], latency)
+            if winner is not None:
+                stats["found"] += 1
+                stats["first_choice_hits"] += int(winner == first_choice)
+                self._winners[memory_key] = winner
+    
+    def find(self, driver, locator_strategies, wait_time=10, parent_element=None, page_type='default'):
+        """返回第一个有匹配的策略找到的元素列表，截止时间内都没有匹配时返回空列表
+        
+        提供parent_element时只在父元素内立即查找一次，不等待。
+        """
+        memory_key = (page_type, tuple(locator_strategies))
+        strategies = self._ordered(memory_key, locator_strategies)
+        search_root = parent_element if parent_element is not None else driver
+        start_time = time.monotonic()
+        found = {}
+        
+        def match_any(_):
+            for strategy in strategies:
+                try:
+                    elements = search_root.find_elements(*strategy)
+                except (NoSuchElementException, StaleElementReferenceException):
+                    continue
                 if elements:
-                    return elements
-        except (TimeoutException, NoSuchElementException, StaleElementReferenceException):
-            continue
-    return []
+                    found["strategy"], found["elements"] = strategy, elements
+                    return True
+            return False
+        
+        if parent_element is not None or wait_time <= 0:
+            match_any(None)
+        else:
+            try:
+                WebDriverWait(driver, wait_time, poll_frequency=self.poll_frequency).until(match_any)
+            except TimeoutException:
+                pass
+        
+        self._record(page_type, memory_key, found.get("strategy"), time.monotonic() - start_time,
+                     strategies[0] if strategies else None)
+        return found.get("elements", [])
+    
+    def report(self):
+        """输出各页面类型的查找次数、命中率和平均耗时"""
+        with self._lock:
+            stats = {page_type: dict(values) for page_type, values in self._stats.items()}
+        if stats:
+            print("元素查找统计:")
+        for page_type, values in sorted(stats.items()):
+            print(f"  {page_type}: 查找 {values['lookups']} 次，找到 {values['found']} 次，"
+                  f"首选策略命中 {values['first_choice_hits']} 次，"
+                  f"平均耗时 {values['seconds'] / values['lookups']:.2f} 秒，最长 {values['max_seconds']:.2f} 秒")
+        return stats
+
+LOCATOR_ENGINE = LocatorEngine()
+
+def safe_find_element(driver, locator_strategies, wait_time=10, parent_element=None, page_type='default'):
+    """使用多种定位策略安全地查找元素，所有策略共用wait_time的截止时间"""
+    elements = LOCATOR_ENGINE.find(driver, locator_strategies, wait_time, parent_element, page_type)
+    return elements[0] if elements else None
+
+def safe_find_elements(driver, locator_strategies, wait_time=10, parent_element=None, page_type='default'):
+    """使用多种定位策略安全地查找多个元素，所有策略共用wait_time的截止时间"""
+    return LOCATOR_ENGINE.find(driver, locator_strategies, wait_time, parent_element, page_type)
 
 def safe_click(driver, element, fallback_js=True, retries=3):
     """安全地点击元素，如果普通点击失败则回退到JavaScript点击"""
@@ -387,6 +2336,547 @@ def wait_for_page_load(driver, timeout=30):
     except:
         return False
 
+#####################################
+# 图片下载
+#####################################
+
+def create_http_session(pool_size=HTTP_POOL_SIZE, user_agent=None):
+    """创建带连接池的HTTP会话，供多个搜索词共享以复用TLS连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        'User-Agent': user_agent or get_random_user_agent(),
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.9',
+    })
+    return session
+
+class ImageDownloader:
+    """基于共享连接池会话的并行图片下载器
+    
+    下载失败时按指数退避重试；对于磁盘上已有的图片，使用ETag或文件大小判断是否需要重新下载。
+    """
+    
+    META_FILENAME = '.download_meta.json'
+    
+    def __init__(self, max_workers=DOWNLOAD_MAX_WORKERS, retries=DOWNLOAD_RETRIES,
+                 backoff_seconds=DOWNLOAD_BACKOFF_SECONDS, session=None, timeout=10):
+        self.max_workers = max(1, max_workers)
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.session = session or create_http_session(pool_size=self.max_workers)
+        self.stats = {
+            "downloaded": 0,
+            "not_modified": 0,
+            "failed": 0,
+            "retries": 0,
+            "bytes": 0,
+            "seconds": 0.0,
+        }
+        self._latencies = []
+        self._meta = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # 记录正在执行的download_many调用，关闭时等待它们完成
+        self._active_calls = 0
+        self._closed = False
+        self._idle_condition = threading.Condition(self._lock)
+        # 所有调用共享同一个线程池，保证同时进行的下载数量不超过上限
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+    
+    def _load_meta(self, folder_path):
+        """读取文件夹中记录图片URL、ETag和大小的元数据"""
+        with self._lock:
+            if folder_path not in self._meta:
+                meta = {}
+                meta_path = os.path.join(folder_path, self.META_FILENAME)
+                if os.path.exists(meta_path):
+                    try:
+                        with open(meta_path, 'r', encoding='utf-8') as f:
+                            meta = json.load(f)
+                    except (OSError, ValueError):
+                        meta = {}
+                self._meta[folder_path] = meta
+            return self._meta[folder_path]
+    
+    def _save_meta(self, folder_path):
+        # 依次写入，避免较旧的快照覆盖较新的记录
+        with self._save_lock:
+            with self._lock:
+                meta = dict(self._meta.get(folder_path, {}))
+            meta_path = os.path.join(folder_path, self.META_FILENAME)
+            temp_path = f"{meta_path}.{threading.get_ident()}.tmp"
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f, ensure_ascii=False, indent=1)
+                os.replace(temp_path, meta_path)
+            except OSError as e:
+                print(f"保存下载记录失败: {e}")
+    
+    def _check_existing(self, image_url, image_path, record):
+        """判断磁盘上已有的图片是否与远程图片一致
+        
+        返回(是否一致, 响应)：条件请求返回200时附带该响应，调用方可直接写入其内容而无需再次请求。
+        """
+        if not record or record.get("url") != image_url or not os.path.exists(image_path):
+            return False, None
+        local_size = os.path.getsize(image_path)
+        if local_size != record.get("size"):
+            return False, None
+        
+        if record.get("etag"):
+            response = self.session.get(
+                image_url, headers={'If-None-Match': record["etag"]}, stream=True, timeout=self.timeout
+            )
+            if response.status_code == 200:
+                return False, response
+            response.close()
+            return response.status_code == 304, None
+        
+        # 没有ETag时比较远程文件大小
+        response = self.session.head(image_url, allow_redirects=True, timeout=self.timeout)
+        content_length = response.headers.get('Content-Length')
+        return response.status_code == 200 and content_length is not None and int(content_length) == local_size, None
+    
+    def _write_response(self, response, image_path):
+        """将响应内容写入临时文件，完整下载后再替换，返回写入的字节数
+        
+        下载中途出错时删除临时文件，避免留下不完整的图片。
+        """
+        temp_path = f"{image_path}.{threading.get_ident()}.part"
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(temp_path, image_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        finally:
+            response.close()
+        return size
+    
+    def download(self, image_url, folder_path, image_filename, record_meta=True):
+        """下载单张图片，返回是否成功（包括磁盘上已有最新图片的情况）
+        
+        record_meta为False时不读写文件夹的下载记录，用于下载后会被移走的暂存文件。
+        """
+        image_path = os.path.join(folder_path, image_filename)
+        # 确保文件夹存在
+        os.makedirs(folder_path, exist_ok=True)
+        meta = self._load_meta(folder_path) if record_meta else {}
+
+        pending_response = None
+        try:
+            up_to_date, pending_response = self._check_existing(image_url, image_path, meta.get(image_filename))
+            if up_to_date:
+                with self._lock:
+                    self.stats["not_modified"] += 1
+                METRICS.count('image_downloads', result='not_modified')
+                print(f"图片未变化，跳过下载 {image_filename}")
+                return True
+        except (requests.RequestException, ValueError):
+            pass
+        
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                with self._lock:
+                    self.stats["retries"] += 1
+                # 指数退避并加入随机抖动
+                time.sleep(self.backoff_seconds * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+            
+            start_time = time.time()
+            try:
+                # 条件请求已经返回了新内容时直接复用该响应
+                if pending_response is not None:
+                    response, pending_response = pending_response, None
+                else:
+                    response = self.session.get(image_url, stream=True, timeout=self.timeout)
+                if response.status_code != 200:
+                    response.close()
+                    print(f"下载图片失败，状态码: {response.status_code}")
+                    # 仅对限流和服务端错误重试
+                    if response.status_code == 429 or response.status_code >= 500:
+                        continue
+                    break
+                
+                size = self._write_response(response, image_path)
+            except (requests.RequestException, OSError) as e:
+                print(f"下载图片时出错: {e}")
+                continue
+            
+            elapsed = time.time() - start_time
+            METRICS.observe('image_download', elapsed)
+            METRICS.count('image_downloads', result='downloaded')
+            METRICS.count('download_bytes', size)
+            with self._lock:
+                self.stats["downloaded"] += 1
+                self.stats["bytes"] += size
+                self.stats["seconds"] += elapsed
+                self._latencies.append(elapsed)
+                if record_meta:
+                    meta[image_filename] = {
+                        "url": image_url,
+                        "etag": response.headers.get('ETag'),
+                        "size": size,
+                    }
+            print(f"图片成功保存为 {image_filename}")
+            return True
+        
+        with self._lock:
+            self.stats["failed"] += 1
+        METRICS.count('image_downloads', result='failed')
+        return False
+    
+    def download_many(self, jobs, record_meta=True):
+        """并行下载多张图片，jobs为(图片URL, 文件夹, 文件名)列表，返回与jobs对应的成功标记"""
+        if not jobs:
+            return []
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("下载器已关闭")
+            self._active_calls += 1
+        try:
+            results = list(self._executor.map(lambda job: self.download(*job, record_meta=record_meta), jobs))
+            if record_meta:
+                for folder_path in {folder_path for _, folder_path, _ in jobs}:
+                    self._save_meta(folder_path)
+        finally:
+            with self._lock:
+                self._active_calls -= 1
+                self._idle_condition.notify_all()
+        return results
+    
+    def close(self):
+        """等待进行中的下载完成后关闭下载线程池和连接池"""
+        with self._lock:
+            self._closed = True
+            while self._active_calls:
+                self._idle_condition.wait()
+        self._executor.shutdown(wait=True)
+        self.session.close()
+    
+    def report(self):
+        """输出本次运行的下载量、带宽和延迟统计"""
+        with self._lock:
+            stats = dict(self.stats)
+            latencies = sorted(self._latencies)
+        if latencies:
+            stats["avg_latency"] = sum(latencies) / len(latencies)
+            stats["p95_latency"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        else:
+            stats["avg_latency"] = stats["p95_latency"] = 0.0
+        # 按单次下载耗时之和估算平均带宽
+        stats["bandwidth_mbps"] = stats["bytes"] / 1024 / 1024 / stats["seconds"] if stats["seconds"] else 0.0
+        print(f"图片下载: 成功 {stats['downloaded']} 张，未变化跳过 {stats['not_modified']} 张，"
+              f"失败 {stats['failed']} 张，重试 {stats['retries']} 次，"
+              f"共 {stats['bytes'] / 1024 / 1024:.2f} MB，平均带宽 {stats['bandwidth_mbps']:.2f} MB/s，"
+              f"平均延迟 {stats['avg_latency']:.2f} 秒，P95延迟 {stats['p95_latency']:.2f} 秒")
+        return stats
+
+_default_downloader = None
+_default_downloader_lock = threading.Lock()
+
+def get_default_downloader():
+    """获取全局共享的图片下载器"""
+    global _default_downloader
+    with _default_downloader_lock:
+        if _default_downloader is None:
+            _default_downloader = ImageDownloader()
+        return _default_downloader
+
+class ImageStore:
+    """所有搜索词共享的内容寻址图片库
+    
+    图片按内容SHA256保存在objects/下，index.json记录图片URL（及对应ASIN）到内容哈希的映射。
+    各搜索词目录中的图片是指向图片库的硬链接（跨文件系统时退回复制），
+    因此同一URL只下载一次，不同URL但内容相同的图片也只保存一份。
+    """
+    
+    INDEX_FILENAME = 'index.json'
+    
+    def __init__(self, directory=IMAGE_STORE_DIRECTORY):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, 'objects')
+        self.staging_dir = os.path.join(directory, 'staging')
+        self.index_path = os.path.join(directory, self.INDEX_FILENAME)
+        self.stats = {
+            "url_hits": 0,
+            "downloaded": 0,
+            "content_duplicates": 0,
+            "linked": 0,
+            "copied": 0,
+            "bandwidth_saved_bytes": 0,
+            "stored_bytes": 0,
+            "linked_bytes": 0,
+        }
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._inflight = {}
+        self._index = self._load_index()
+    
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取图片库索引失败: {e}")
+            return {}
+    
+    def _save_index(self):
+        # 多个下载线程依次写入，避免较旧的快照覆盖较新的索引
+        with self._save_lock:
+            with self._lock:
+                index = dict(self._index)
+            temp_path = f"{self.index_path}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(index, f, ensure_ascii=False)
+                os.replace(temp_path, self.index_path)
+            except OSError as e:
+                print(f"保存图片库索引失败: {e}")
+    
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+    
+    def lookup(self, image_url):
+        """返回图片URL对应且仍存在的内容哈希，未下载过时返回None"""
+        with self._lock:
+            entry = self._index.get(image_url)
+        if entry and os.path.exists(self.object_path(entry["sha256"])):
+            return entry["sha256"]
+        return None
+    
+    def _ingest(self, staged_path, image_url, asin):
+        """把下载到暂存区的图片移入图片库并记录URL，返回内容哈希"""
+        digest = file_sha256(staged_path)
+        size = os.path.getsize(staged_path)
+        object_path = self.object_path(digest)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        with self._lock:
+            if os.path.exists(object_path):
+                # 不同URL但内容相同的图片只保存一份
+                os.remove(staged_path)
+                self.stats["content_duplicates"] += 1
+            else:
+                os.replace(staged_path, object_path)
+                self.stats["stored_bytes"] += size
+            self.stats["downloaded"] += 1
+            self._index[image_url] = {"sha256": digest, "asin": asin, "size": size}
+        return digest
+    
+    def link(self, digest, target_path):
+        """在目标位置创建指向图片库对象的硬链接，目标已是同一文件时不做任何事"""
+        object_path = self.object_path(digest)
+        if os.path.exists(target_path) and os.path.samefile(object_path, target_path):
+            return
+        temp_path = f"{target_path}.{threading.get_ident()}.link"
+        try:
+            os.link(object_path, temp_path)
+            linked = True
+        except OSError:
+            shutil.copy2(object_path, temp_path)
+            linked = False
+        os.replace(temp_path, target_path)
+        size = os.path.getsize(object_path)
+        with self._lock:
+            if linked:
+                self.stats["linked"] += 1
+                self.stats["linked_bytes"] += size
+            else:
+                self.stats["copied"] += 1
+    
+    def _count_hit(self, digest):
+        size = os.path.getsize(self.object_path(digest))
+        METRICS.count('cache_lookups', cache='image_store', result='hit')
+        METRICS.count('image_store_saved_bytes', size)
+        with self._lock:
+            self.stats["url_hits"] += 1
+            self.stats["bandwidth_saved_bytes"] += size
+
+    def materialize_many(self, jobs, downloader):
+        """把图片放入搜索词目录，jobs为(图片URL, ASIN, 文件夹, 文件名)列表，返回与jobs对应的成功标记
+        
+        图片库中已有的URL直接链接；其余URL去重后通过下载器并行下载到暂存区再移入图片库，
+        其他搜索词正在下载的URL等待其完成后直接链接。
+        """
+        digests = {}
+        missing = []
+        waiting = {}
+        for image_url, asin, _, _ in jobs:
+            if image_url in digests:
+                continue
+            digest = self.lookup(image_url)
+            digests[image_url] = digest
+            if digest is not None:
+                self._count_hit(digest)
+                continue
+            with self._lock:
+                # 其他搜索词正在下载同一URL时等待其完成，不重复下载
+                event = self._inflight.get(image_url)
+                if event is None:
+                    self._inflight[image_url] = threading.Event()
+                    missing.append((image_url, asin))
+                    METRICS.count('cache_lookups', cache='image_store', result='miss')
+                else:
+                    waiting[image_url] = event
+
+        if missing:
+            staged = [
+                (image_url, asin, hashlib.sha256(image_url.encode('utf-8')).hexdigest()[:32])
+                for image_url, asin in missing
+            ]
+            try:
+                # 暂存文件下载后立即移入图片库，不记录下载元数据
+                saved_flags = downloader.download_many([
+                    (image_url, self.staging_dir, staged_name) for image_url, _, staged_name in staged
+                ], record_meta=False)
+                for (image_url, asin, staged_name), saved in zip(staged, saved_flags):
+                    staged_path = os.path.join(self.staging_dir, staged_name)
+                    if saved and os.path.exists(staged_path):
+                        try:
+                            digests[image_url] = self._ingest(staged_path, image_url, asin)
+                        except OSError as e:
+                            print(f"保存图片到图片库失败: {e}")
+                self._save_index()
+            finally:
+                with self._lock:
+                    events = [self._inflight.pop(image_url) for image_url, _ in missing]
+                for event in events:
+                    event.set()
+
+        for image_url, event in waiting.items():
+            event.wait()
+            digest = self.lookup(image_url)
+            digests[image_url] = digest
+            if digest is not None:
+                self._count_hit(digest)
+
+        results = []
+        for image_url, _, folder_path, image_filename in jobs:
+            digest = digests.get(image_url)
+            if digest is None:
+                results.append(False)
+                continue
+            try:
+                os.makedirs(folder_path, exist_ok=True)
+                self.link(digest, os.path.join(folder_path, image_filename))
+                results.append(True)
+            except OSError as e:
+                print(f"链接图片 {image_filename} 失败: {e}")
+                results.append(False)
+        return results
+    
+    def report(self):
+        """输出图片库节省的下载流量和磁盘空间"""
+        with self._lock:
+            stats = dict(self.stats)
+        # 每个硬链接原本都需要一份独立的文件，减去本次新写入图片库的字节数即为节省的磁盘空间
+        stats["disk_saved_bytes"] = max(0, stats["linked_bytes"] - stats["stored_bytes"])
+        print(f"图片库: URL命中 {stats['url_hits']} 次，新下载 {stats['downloaded']} 张"
+              f"（其中内容重复 {stats['content_duplicates']} 张），硬链接 {stats['linked']} 个，复制 {stats['copied']} 个，"
+              f"节省流量 {stats['bandwidth_saved_bytes'] / 1024 / 1024:.2f} MB，"
+              f"节省磁盘 {stats['disk_saved_bytes'] / 1024 / 1024:.2f} MB")
+        return stats
+
+#####################################
+# 产品清单与索引
+#####################################
+
+MANIFEST_FILENAME = 'manifest.json'
+
+def build_my_product_index(directory=None):
+    """扫描一次我的产品图片目录，返回{产品名: 图片路径}索引"""
+    if directory is None:
+        directory = MY_IMAGE_DIRECTORY
+    index = {}
+    if not os.path.isdir(directory):
+        return index
+    for file in sorted(os.listdir(directory)):
+        if os.path.splitext(file)[1].lower() in IMAGE_EXTENSIONS:
+            product_name = os.path.splitext(file)[0]
+            index.setdefault(product_name, os.path.join(directory, file))
+    return index
+
+def list_amazon_images(amazon_dir):
+    """列出搜索词目录中已下载的亚马逊产品图片"""
+    if not os.path.exists(amazon_dir):
+        return []
+    return [
+        os.path.join(amazon_dir, file)
+        for file in os.listdir(amazon_dir)
+        if os.path.splitext(file)[1].lower() in IMAGE_EXTENSIONS
+    ]
+
+def write_term_manifest(search_dir, products):
+    """写入搜索词的产品清单，记录每个产品的标题、ASIN、图片URL、内容哈希和本地文件名"""
+    entries = []
+    for product_data in products:
+        image_file = product_data.get('image_file') if product_data.get('image_saved') else None
+        image_path = os.path.join(search_dir, image_file) if image_file else None
+        entries.append({
+            "title": product_data.get('title'),
+            "asin": product_data.get('asin'),
+            "image_url": product_data.get('image_url'),
+            "sponsored": product_data.get('sponsored', False),
+            "file": image_file,
+            "sha256": file_sha256(image_path) if image_path and os.path.exists(image_path) else None,
+        })
+    
+    manifest_path = os.path.join(search_dir, MANIFEST_FILENAME)
+    try:
+        with open(f"{manifest_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({"created_at": time.time(), "products": entries}, f, ensure_ascii=False, indent=1)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+    except OSError as e:
+        print(f"保存产品清单失败: {e}")
+    return entries
+
+def load_term_manifest(search_dir):
+    """读取搜索词的产品清单
+    
+    旧版本爬取的目录没有清单，此时根据已下载的图片生成一次清单（标题取自文件名）。
+    """
+    manifest_path = os.path.join(search_dir, MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)["products"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"读取产品清单失败，根据图片重新生成: {e}")
+    
+    image_files = sorted(list_amazon_images(search_dir))
+    if not image_files:
+        return []
+    products = [
+        {
+            "title": os.path.splitext(os.path.basename(image_file))[0],
+            "image_file": os.path.basename(image_file),
+            "image_saved": True,
+        }
+        for image_file in image_files
+    ]
+    return write_term_manifest(search_dir, products)
+
+def manifest_image_titles(search_dir, entries):
+    """返回清单中已下载且仍存在于磁盘上的图片的{图片路径: 产品标题}"""
+    return {
+        os.path.join(search_dir, entry["file"]): entry["title"] or os.path.splitext(entry["file"])[0]
+        for entry in entries
+        if entry.get("file") and os.path.exists(os.path.join(search_dir, entry["file"]))
+    }
+
 #####################################
 # 亚马逊爬虫函数
 #####################################
@@ -397,9 +2887,6 @@ def open_amazon(driver, url="https://www.amazon.com", wait_time=15):
         print(f"正在打开亚马逊网站: {url}")
         driver.get(url)
         
-        # 等待页面加载
-        wait_for_page_load(driver)
-        
         # 可能的亚马逊logo标识符
         logo_locators = [
             (By.ID, "nav-logo-sprites"),
@@ -408,14 +2895,15 @@ def open_amazon(driver, url="https://www.amazon.com", wait_time=15):
             (By.XPATH, "//a[contains(@aria-label, 'Amazon')]"),
         ]
         
-        # 等待亚马逊logo以确认页面已加载
-        logo = safe_find_element(driver, logo_locators, wait_time)
+        # 等待亚马逊logo出现且网络空闲以确认页面已加载
+        wait_for_page_ready(driver, 'home', logo_locators, wait_time)
+        logo = safe_find_element(driver, logo_locators, 1, page_type='home')
         
         if logo:
             print("亚马逊网站加载成功")
             
-            # 添加随机延迟使自动化行为不易被检测
-            random_sleep(15, 20)
+            # 按节奏策略停顿，使自动化行为不易被检测
+            pace('after_open')
             return True
         else:
             print("亚马逊logo未找到，但页面已加载")
@@ -441,16 +2929,16 @@ def search_amazon(driver, search_term, wait_time=15):
     
     # 使用多种策略查找搜索框
     print(f"搜索 '{search_term}'")
-    search_box = safe_find_element(driver, search_box_locators, wait_time)
+    search_box = safe_find_element(driver, search_box_locators, wait_time, page_type='search_box')
     
     if search_box:
         print("找到搜索框，输入搜索词")
         # 在与搜索框交互前添加小延迟
-        random_sleep(0.5, 1.5)
+        pace('before_typing')
         
         if safe_send_keys(search_box, search_term):
             # 提交前再添加一个小延迟
-            random_sleep(0.5, 1.5)
+            pace('before_submit')
             
             # 尝试提交表单
             try:
@@ -466,7 +2954,7 @@ def search_amazon(driver, search_term, wait_time=15):
                     (By.XPATH, "//input[@type='submit' and contains(@class, 'nav-input')]"),
                 ]
                 
-                search_button = safe_find_element(driver, search_button_locators, wait_time)
+                search_button = safe_find_element(driver, search_button_locators, wait_time, page_type='search_box')
                 if search_button and safe_click(driver, search_button):
                     print("通过点击搜索按钮提交搜索")
                 else:
@@ -476,22 +2964,20 @@ def search_amazon(driver, search_term, wait_time=15):
                         "document.querySelector('form[name=\"site-search\"], form[role=\"search\"], form#nav-search-bar-form').submit();"
                     )
             
-            # 等待页面加载
-            wait_for_page_load(driver)
-            
-            # 等待搜索结果加载
+            # 等待搜索结果列表出现且网络空闲
             result_locators = [
                 (By.CSS_SELECTOR, ".s-result-item"),
                 (By.CSS_SELECTOR, "[data-component-type='s-search-result']"),
                 (By.CSS_SELECTOR, ".sg-col-inner"),
             ]
+            wait_for_page_ready(driver, 'search', result_locators, wait_time)
             
-            results = safe_find_elements(driver, result_locators, wait_time)
+            results = safe_find_elements(driver, result_locators, 1, page_type='search')
             
             if results:
                 print(f"搜索结果加载成功 (找到 {len(results)} 项)")
-                # 添加随机延迟使自动化行为不易被检测
-                random_sleep(1, 3)
+                # 按节奏策略停顿，使自动化行为不易被检测
+                pace('after_results')
                 return True
             else:
                 print("未找到搜索结果")
@@ -517,22 +3003,20 @@ def search_amazon(driver, search_term, wait_time=15):
             )
             print("通过JavaScript执行搜索")
             
-            # 等待页面加载
-            wait_for_page_load(driver)
-            
             # 等待是否出现结果
             result_locators = [
                 (By.CSS_SELECTOR, ".s-result-item"),
                 (By.CSS_SELECTOR, "[data-component-type='s-search-result']"),
                 (By.CSS_SELECTOR, ".sg-col-inner"),
             ]
+            wait_for_page_ready(driver, 'search', result_locators, wait_time)
             
-            results = safe_find_elements(driver, result_locators, wait_time)
+            results = safe_find_elements(driver, result_locators, 1, page_type='search')
             
             if results:
                 print(f"通过JavaScript成功加载搜索结果 (找到 {len(results)} 项)")
-                # 添加随机延迟使自动化行为不易被检测
-                random_sleep(1, 3)
+                # 按节奏策略停顿，使自动化行为不易被检测
+                pace('after_results')
                 return True
             else:
                 print("JavaScript注入后未找到搜索结果")
@@ -541,48 +3025,265 @@ def search_amazon(driver, search_term, wait_time=15):
             print(f"JavaScript搜索注入失败: {e}")
             return False
 
+def build_image_filename(product_title, product_number):
+    """使用产品标题生成图片文件名，标题为空时回退到编号命名"""
+    product_title = product_title.lower()
+    # 清理标题，将非下划线的符号替换为下划线
+    clean_title = re.sub(r'[^\w\s]', '_', product_title)  # 将非字母数字下划线的字符替换为下划线
+    clean_title = re.sub(r'\s+', '_', clean_title)  # 将空格替换为下划线
+    
+    # 如果标题过长，截取一部分以防文件名过长
+    if len(clean_title) > 100:
+        clean_title = clean_title[:100]
+    
+    # 如果出现任何错误，回退到编号命名
+    if not clean_title:
+        return f"产品{product_number}.jpg"
+    return f"{clean_title}.jpg"
+
 def download_image(image_url, folder_path, product_title, product_number):
     """下载图片并保存到指定文件夹，使用产品标题作为文件名"""
-    product_title = product_title.lower()
     try:
-        # 清理标题，将非下划线的符号替换为下划线
-        import re
-        clean_title = re.sub(r'[^\w\s]', '_', product_title)  # 将非字母数字下划线的字符替换为下划线
-        clean_title = re.sub(r'\s+', '_', clean_title)  # 将空格替换为下划线
-        
-        # 如果标题过长，截取一部分以防文件名过长
-        if len(clean_title) > 100:
-            clean_title = clean_title[:100]
-        
-        # 创建图片文件名 - 使用产品标题
-        image_filename = f"{clean_title}.jpg"
+        image_filename = build_image_filename(product_title, product_number)
+    except Exception as e:
+        print(f"下载图片时出错: {e}")
+        return False
+    return get_default_downloader().download_many([(image_url, folder_path, image_filename)])[0]
+
+def pick_image_url(src, srcset):
+    """如果有srcset，从中提取最高分辨率图片的URL，否则返回src"""
+    if srcset:
+        try:
+            # 解析srcset获取最高分辨率图片
+            srcset_parts = srcset.split(',')
+            high_res_src = srcset_parts[-1].strip().split(' ')[0]
+            if high_res_src:
+                return high_res_src
+        except:
+            pass
+    return src
+
+# 一次调用提取页面上所有产品卡片的脚本，选择器与逐元素提取的定位器一致
+EXTRACT_CARDS_SCRIPT = """
+var containerSelectors = [
+    "[data-component-type='s-search-result']",
+    ".s-result-item",
+    ".sg-col-inner .a-section"
+];
+var titleSelectors = ["h2 a span", ".a-size-medium.a-color-base.a-text-normal", ".a-link-normal .a-text-normal"];
+var imageSelectors = [".s-image", "img[data-image-latency='s-product-image']", ".a-section img"];
+var sponsoredSelectors = [
+    ".puis-sponsored-label-text",
+    ".s-sponsored-label-text",
+    "[data-component-type='sp-sponsored-result']",
+    "a[aria-label*='Sponsored']"
+];
+
+function firstMatch(root, selectors) {
+    for (var i = 0; i < selectors.length; i++) {
+        var element = root.querySelector(selectors[i]);
+        if (element) return element;
+    }
+    return null;
+}
+
+var cards = [];
+for (var i = 0; i < containerSelectors.length; i++) {
+    cards = document.querySelectorAll(containerSelectors[i]);
+    if (cards.length) break;
+}
+
+var results = [];
+for (var j = 0; j < cards.length; j++) {
+    var card = cards[j];
+    var titleElement = firstMatch(card, titleSelectors);
+    var imageElement = firstMatch(card, imageSelectors);
+    var asinElement = card.closest('[data-asin]');
+    results.push({
+        title: titleElement ? titleElement.textContent.trim() : null,
+        src: imageElement ? imageElement.src : null,
+        srcset: imageElement ? imageElement.getAttribute('srcset') : null,
+        asin: (card.getAttribute('data-asin') || (asinElement && asinElement.getAttribute('data-asin')) || null),
+        sponsored: !!firstMatch(card, sponsoredSelectors)
+    });
+}
+return JSON.stringify(results);
+"""
+
+def extract_product_cards_js(driver):
+    """通过一次execute_script调用提取所有产品卡片的标题、图片、ASIN和广告标记，失败时返回None"""
+    try:
+        return json.loads(driver.execute_script(EXTRACT_CARDS_SCRIPT))
+    except (WebDriverException, TypeError, ValueError) as e:
+        print(f"脚本提取产品卡片失败: {e}")
+        return None
+
+def collect_products(cards, max_products):
+    """根据产品卡片数据构建产品信息，跳过没有标题的卡片"""
+    products = []
+    for card in cards:
+        if len(products) >= max_products:
+            break
+        # 只有当我们至少有标题时才添加产品
+        if not card.get('title'):
+            continue
         
-        # 如果出现任何错误，回退到编号命名
-        if not clean_title:
-            image_filename = f"产品{product_number}.jpg"
+        product_data = {
+            'title': card['title'],
+            'asin': card.get('asin') or None,
+            'sponsored': bool(card.get('sponsored')),
+        }
+        if card.get('src') or card.get('srcset'):
+            product_data['image_url'] = pick_image_url(card.get('src'), card.get('srcset'))
         
-        image_path = os.path.join(folder_path, image_filename)
+        products.append(product_data)
+        print(f"提取的产品 {len(products)}: {product_data['title'][:50]}...")
+    return products
+
+def crawl_result_pages(first_page_cards, fetch_pages, max_products, max_pages=None, concurrency=None):
+    """从第1页的产品卡片开始，按批并发读取后续结果页并按ASIN去重，返回按页码顺序排列的卡片
+    
+    fetch_pages(页码列表)返回{页码: 卡片列表}，加载失败的页对应None。每批只请求凑够
+    max_products预计还需要的页数；产品数量足够、某页没有新产品或加载失败时停止。
+    """
+    if max_pages is None:
+        max_pages = SEARCH_MAX_PAGES
+    if concurrency is None:
+        concurrency = SEARCH_PAGE_CONCURRENCY
+    seen = set()
+    cards = []
+    
+    def add_page(page_cards):
+        added = 0
+        for card in page_cards:
+            if not card.get('title'):
+                continue
+            # 没有ASIN的卡片按标题和图片地址去重
+            key = card.get('asin') or (card['title'], card.get('src'))
+            if key in seen:
+                continue
+            seen.add(key)
+            cards.append(card)
+            added += 1
+        return added
+    
+    per_page = add_page(first_page_cards)
+    pages_read = 1
+    next_page = 2
+    while per_page and len(cards) < max_products and next_page <= max_pages:
+        pages_needed = -(-(max_products - len(cards)) // per_page)
+        last_page = min(max_pages, next_page + min(max(1, concurrency), pages_needed) - 1)
+        batch = list(range(next_page, last_page + 1))
+        results = fetch_pages(batch)
+        next_page = last_page + 1
         
-        # 确保文件夹存在
-        os.makedirs(folder_path, exist_ok=True)
+        exhausted = False
+        for page in batch:
+            page_cards = results.get(page)
+            pages_read += 1
+            if not page_cards or add_page(page_cards) == 0:
+                exhausted = True
+                break
+            if len(cards) >= max_products:
+                break
+        if exhausted:
+            break
+    
+    print(f"读取 {pages_read} 页搜索结果，去重后共 {len(cards)} 个产品")
+    return cards
+
+def download_product_images(products, search_dir, downloader=None, image_store=None):
+    """并行下载产品图片，使用标题作为文件名，记录每个产品的下载结果并写入产品清单
+    
+    标题相同的产品在文件名后追加ASIN（没有ASIN时追加编号），避免互相覆盖。
+    提供image_store时图片先放入全局图片库，搜索词目录中只创建硬链接。
+    """
+    if downloader is None:
+        downloader = get_default_downloader()
+    
+    jobs = []
+    used_filenames = set()
+    for number, product_data in enumerate(products, start=1):
+        if not product_data.get('image_url'):
+            continue
+        image_filename = build_image_filename(product_data['title'], number)
+        if image_filename in used_filenames:
+            stem, extension = os.path.splitext(image_filename)
+            image_filename = f"{stem}_{product_data.get('asin') or number}{extension}"
+            if image_filename in used_filenames:
+                image_filename = f"{stem}_{number}{extension}"
+        used_filenames.add(image_filename)
+        product_data['image_file'] = image_filename
+        jobs.append((product_data, (product_data['image_url'], search_dir, image_filename)))
+    
+    if image_store is not None:
+        saved_flags = image_store.materialize_many([
+            (image_url, product_data.get('asin'), folder_path, image_filename)
+            for product_data, (image_url, folder_path, image_filename) in jobs
+        ], downloader)
+    else:
+        saved_flags = downloader.download_many([job for _, job in jobs])
+    for (product_data, _), saved in zip(jobs, saved_flags):
+        product_data['image_saved'] = saved
+    
+    write_term_manifest(search_dir, products)
+    return products
+
+def build_page_url(url, page):
+    """在搜索结果页URL中设置页码"""
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key != 'page']
+    query.append(('page', str(page)))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), parts.fragment))
+
+def load_result_pages_in_tabs(driver, pages):
+    """在新标签页中同时打开多个结果页，逐个等待就绪并提取产品卡片，返回{页码: 卡片列表}
+    
+    所有标签页先通过window.open一起开始加载，之后依次切换读取并关闭，最后回到原标签页。
+    """
+    main_handle = driver.current_window_handle
+    base_url = driver.current_url
+    tabs = {}
+    results = {}
+    try:
+        for page in pages:
+            before = set(driver.window_handles)
+            driver.execute_script("window.open(arguments[0], '_blank');", build_page_url(base_url, page))
+            new_handles = set(driver.window_handles) - before
+            if new_handles:
+                tabs[page] = new_handles.pop()
         
-        # 下载图片
-        response = requests.get(image_url, stream=True, timeout=10)
-        if response.status_code == 200:
-            with open(image_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print(f"图片成功保存为 {image_filename}")
-            return True
-        else:
-            print(f"下载图片失败，状态码: {response.status_code}")
-            return False
-    except Exception as e:
-        print(f"下载图片时出错: {e}")
-        return False
+        result_locators = [
+            (By.CSS_SELECTOR, "[data-component-type='s-search-result']"),
+            (By.CSS_SELECTOR, ".s-result-item"),
+        ]
+        for page in pages:
+            handle = tabs.get(page)
+            if handle is None:
+                results[page] = None
+                continue
+            try:
+                driver.switch_to.window(handle)
+                if wait_for_page_ready(driver, 'search', result_locators):
+                    results[page] = extract_product_cards_js(driver)
+                else:
+                    print(f"第 {page} 页未加载出搜索结果")
+                    results[page] = None
+            except WebDriverException as e:
+                print(f"加载第 {page} 页时出错: {e}")
+                results[page] = None
+    finally:
+        for handle in tabs.values():
+            try:
+                driver.switch_to.window(handle)
+                driver.close()
+            except WebDriverException:
+                pass
+        driver.switch_to.window(main_handle)
+    return results
 
-def extract_products(driver, search_term, max_products=10):
-    """从搜索结果中提取产品信息并下载图片"""
+def extract_products(driver, search_term, max_products=10, downloader=None, download=True):
+    """从搜索结果中提取产品信息并下载图片，download为False时只提取产品信息"""
     
     print(f"提取'{search_term}'的最多 {max_products} 个产品信息")
     
@@ -591,6 +3292,21 @@ def extract_products(driver, search_term, max_products=10):
     search_dir = os.path.join(base_dir, search_term)
     os.makedirs(search_dir, exist_ok=True)
     
+    # 优先通过一次脚本调用提取所有产品卡片，产品不够时在新标签页中并发加载后续结果页
+    cards = extract_product_cards_js(driver)
+    if cards:
+        cards = crawl_result_pages(
+            cards, lambda pages: load_result_pages_in_tabs(driver, pages), max_products
+        )
+        products = collect_products(cards, max_products)
+        if download:
+            download_product_images(products, search_dir, downloader)
+        print(f"成功提取 {len(products)} 个'{search_term}'的产品")
+        return products
+    
+    # 回退到逐个元素提取
+    print("脚本未提取到产品卡片，改为逐个元素提取")
+    
     # 产品容器定位器
     product_locators = [
         (By.CSS_SELECTOR, "[data-component-type='s-search-result']"),
@@ -599,7 +3315,7 @@ def extract_products(driver, search_term, max_products=10):
     ]
     
     # 查找产品容器
-    product_elements = safe_find_elements(driver, product_locators)
+    product_elements = safe_find_elements(driver, product_locators, page_type='search')
     
     if not product_elements:
         print("未找到产品元素")
@@ -614,7 +3330,7 @@ def extract_products(driver, search_term, max_products=10):
             
         try:
             # 提取产品数据
-            product_data = {}
+            product_data = {'asin': product_element.get_attribute('data-asin') or None}
             
             # 标题
             title_locators = [
@@ -622,7 +3338,9 @@ def extract_products(driver, search_term, max_products=10):
                 (By.CSS_SELECTOR, ".a-size-medium.a-color-base.a-text-normal"),
                 (By.CSS_SELECTOR, ".a-link-normal .a-text-normal")
             ]
-            title_element = safe_find_element(driver, title_locators, parent_element=product_element)
+            title_element = safe_find_element(
+                driver, title_locators, parent_element=product_element, page_type='product_card'
+            )
             if title_element:
                 product_data['title'] = title_element.text.strip()
             
@@ -633,31 +3351,13 @@ def extract_products(driver, search_term, max_products=10):
                 (By.CSS_SELECTOR, ".a-section img"),
                 (By.XPATH, ".//img[contains(@class, 's-image') or contains(@class, 'product-image')]")
             ]
-            image_element = safe_find_element(driver, image_locators, parent_element=product_element)
+            image_element = safe_find_element(
+                driver, image_locators, parent_element=product_element, page_type='product_card'
+            )
             if image_element:
                 # 尝试获取高质量图片URL
-                src = image_element.get_attribute("src")
-                srcset = image_element.get_attribute("srcset")
-                
-                # 如果有srcset，从中提取最高分辨率图片
-                if srcset:
-                    try:
-                        # 解析srcset获取最高分辨率图片
-                        srcset_parts = srcset.split(',')
-                        high_res_src = srcset_parts[-1].strip().split(' ')[0]
-                        if high_res_src:
-                            src = high_res_src
-                    except:
-                        pass
-                        
+                src = pick_image_url(image_element.get_attribute("src"), image_element.get_attribute("srcset"))
                 product_data['image_url'] = src
-                
-                # 下载图片，现在使用标题作为文件名
-                if src and 'title' in product_data:
-                    if download_image(src, search_dir, product_data['title'], count + 1):
-                        product_data['image_saved'] = True
-                    else:
-                        product_data['image_saved'] = False
             
             # 只有当我们至少有标题时才添加产品
             if 'title' in product_data:
@@ -669,14 +3369,661 @@ def extract_products(driver, search_term, max_products=10):
             print(f"提取产品数据时出错: {e}")
             continue
     
+    # 提取完成后统一下载图片，使用标题作为文件名
+    if download:
+        download_product_images(products, search_dir, downloader)
+    
+    print(f"成功提取 {len(products)} 个'{search_term}'的产品")
+    return products
+
+#####################################
+# HTTP爬虫后端
+#####################################
+
+def fetch_search_page(session, search_term, page=1, base_url=None, timeout=15):
+    """请求亚马逊搜索结果页，返回HTML文本"""
+    params = {'k': search_term}
+    if page > 1:
+        params['page'] = page
+    with METRICS.span('search_page_fetch', backend='http'):
+        response = session.get(f"{(base_url or AMAZON_BASE_URL).rstrip('/')}/s", params=params, timeout=timeout)
+        response.raise_for_status()
+    METRICS.count('search_page_bytes', len(response.content))
+    return response.text
+
+def resolve_srcset(srcset, base_url):
+    """将srcset中的相对图片地址补全为绝对地址"""
+    candidates = []
+    for candidate in srcset.split(','):
+        parts = candidate.strip().split(' ', 1)
+        if parts[0]:
+            parts[0] = urljoin(base_url, parts[0])
+            candidates.append(' '.join(parts))
+    return ', '.join(candidates)
+
+def parse_search_results(page_html, base_url=None):
+    """解析搜索结果页中的产品卡片，返回与extract_product_cards_js相同格式的字典列表"""
+    document = lxml_html.fromstring(page_html)
+    
+    # 产品容器定位器（与浏览器后端的定位顺序一致）
+    card_xpaths = [
+        "//div[@data-component-type='s-search-result']",
+        "//div[contains(concat(' ', normalize-space(@class), ' '), ' s-result-item ')]",
+    ]
+    cards = []
+    for xpath in card_xpaths:
+        cards = document.xpath(xpath)
+        if cards:
+            break
+    
+    title_xpaths = [
+        ".//h2//a//span",
+        ".//h2//span",
+        ".//*[contains(@class, 'a-size-medium') and contains(@class, 'a-text-normal')]",
+    ]
+    image_xpaths = [
+        ".//img[contains(concat(' ', normalize-space(@class), ' '), ' s-image ')]",
+        ".//img[@data-image-latency='s-product-image']",
+    ]
+    sponsored_xpath = (
+        ".//*[contains(@class, 'puis-sponsored-label-text') or contains(@class, 's-sponsored-label-text')"
+        " or @data-component-type='sp-sponsored-result']"
+        " | .//a[contains(@aria-label, 'Sponsored')]"
+    )
+    
+    results = []
+    for card in cards:
+        title = None
+        for xpath in title_xpaths:
+            elements = card.xpath(xpath)
+            if elements:
+                title = elements[0].text_content().strip()
+                if title:
+                    break
+        
+        image = None
+        for xpath in image_xpaths:
+            elements = card.xpath(xpath)
+            if elements:
+                image = elements[0]
+                break
+        
+        src = image.get('src') if image is not None else None
+        srcset = image.get('srcset') if image is not None else None
+        if base_url:
+            # 相对路径的图片地址按站点地址补全
+            src = urljoin(base_url, src) if src else src
+            srcset = resolve_srcset(srcset, base_url) if srcset else srcset
+        
+        results.append({
+            'title': title,
+            'src': src,
+            'srcset': srcset,
+            'asin': card.get('data-asin') or None,
+            'sponsored': bool(card.xpath(sponsored_xpath)),
+        })
+    return results
+
+def is_captcha_page(page_html):
+    """判断返回的页面是否为验证码或验证页面"""
+    return "captcha" in page_html.lower() and "s-result-item" not in page_html
+
+def extract_products_http(session, search_term, max_products=10, base_url=None, downloader=None, download=True):
+    """通过HTTP请求提取搜索结果中的产品信息并下载图片，返回与extract_products相同格式的数据"""
+    
+    print(f"提取'{search_term}'的最多 {max_products} 个产品信息 (HTTP)")
+    
+    # 确保存放图片的目录存在
+    search_dir = os.path.join("images", search_term)
+    os.makedirs(search_dir, exist_ok=True)
+    
+    page_base_url = f"{(base_url or AMAZON_BASE_URL).rstrip('/')}/"
+    page_html = fetch_search_page(session, search_term, base_url=base_url)
+    if is_captcha_page(page_html):
+        print("检测到验证码或验证页面")
+        return []
+    
+    def fetch_page(page):
+        try:
+            html = fetch_search_page(session, search_term, page=page, base_url=base_url)
+        except requests.RequestException as e:
+            print(f"请求第 {page} 页失败: {e}")
+            return page, None
+        if is_captcha_page(html):
+            print(f"第 {page} 页检测到验证码或验证页面")
+            return page, None
+        return page, parse_search_results(html, base_url=page_base_url)
+    
+    def fetch_pages(pages):
+        # 后续结果页通过共享的连接池并发请求
+        with ThreadPoolExecutor(max_workers=len(pages)) as executor:
+            return dict(executor.map(fetch_page, pages))
+    
+    cards = crawl_result_pages(parse_search_results(page_html, base_url=page_base_url), fetch_pages, max_products)
+    products = collect_products(cards, max_products)
+    if download:
+        download_product_images(products, search_dir, downloader)
+    
     print(f"成功提取 {len(products)} 个'{search_term}'的产品")
     return products
 
+#####################################
+# 竞品分析函数
+#####################################
+
+def run_title_stage(records, context):
+    """标题判定阶段：检查产品标题是否包含我的产品关键词"""
+    return [(get_title_analyze(context["my_product_keywords"], record["标题"]), None) for record in records]
+
+def run_image_stage(records, context):
+    """图像判定阶段：并发调用视觉模型，每组近似图片只分析代表图片
+    
+    VLM_BATCH_SIZE大于1时代表图片按批发送，每批一次请求。
+    每个判定结果返回后立即持久化到判定缓存，中断后重启时已完成的比较直接命中缓存。
+    """
+    my_product_file = context["my_product_file"]
+    cancel_event = context.get("cancel_event")
+    representatives = sorted({record["代表图片"] for record in records})
+    if not representatives:
+        return []
+    batch_size = max(1, VLM_BATCH_SIZE)
+    batches = [representatives[i:i + batch_size] for i in range(0, len(representatives), batch_size)]
+    
+    def analyze_batch(batch):
+        if cancel_event is not None and cancel_event.is_set():
+            return [(None, "已取消")] * len(batch)
+        try:
+            if len(batch) == 1:
+                return [(get_img_analyze(my_product_file, batch[0]), None)]
+            return [(verdict, None) for verdict in get_img_analyze_batch(my_product_file, batch)]
+        except TransientApiError:
+            # API暂时不可用时整个搜索词稍后重试，而不是把这些产品记为出错
+            raise
+        except Exception as e:
+            return [(None, str(e))] * len(batch)
+    
+    max_workers = max(1, min(context["max_workers"], len(batches)))
+    print(f"图像判定: {len(representatives)} 次比较，{len(batches)} 次请求 (并发数: {max_workers})")
+    verdicts = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch, batch_verdicts in zip(batches, executor.map(analyze_batch, batches)):
+            verdicts.update(zip(batch, batch_verdicts))
+    return [verdicts[record["代表图片"]] for record in records]
+
+def run_visual_stage(records, context):
+    """本地视觉预筛选阶段：相似度低于VISUAL_SIMILARITY_FLOOR的产品判定为NO，不再发送给视觉模型
+    
+    每组近似图片只计算代表图片，相似度记录在"视觉相似度"字段；无法提取特征的图片不剪掉。
+    """
+    representatives = sorted({record["代表图片"] for record in records})
+    if not representatives:
+        return []
+    try:
+        scores = dict(zip(representatives, score_visual_similarity(context["my_product_file"], representatives)))
+    except Exception as e:
+        print(f"计算视觉相似度失败，跳过预筛选: {e}")
+        return [('YES', None)] * len(records)
+    
+    results = []
+    for record in records:
+        score = float(scores[record["代表图片"]])
+        record["视觉相似度"] = round(score, 4)
+        results.append(('YES' if score >= VISUAL_SIMILARITY_FLOOR else 'NO', None))
+    pruned = sum(1 for verdict, _ in results if verdict == 'NO')
+    print(f"视觉预筛选: {len(records)} 个产品中 {pruned} 个相似度低于 {VISUAL_SIMILARITY_FLOOR}，不再调用视觉模型")
+    return results
+
+# 判定阶段注册表：成本越低越先执行，结果字段记录该阶段的结论
+DECISION_STAGE_REGISTRY = {
+    'title': {"成本": 0, "结果字段": "标题结论", "函数": run_title_stage},
+    'visual': {"成本": 10, "结果字段": "视觉结论", "函数": run_visual_stage},
+    'image': {"成本": 100, "结果字段": "图像结论", "函数": run_image_stage},
+}
+
+def run_decision_cascade(records, context, stages=None, full_evaluation=None):
+    """按成本顺序执行判定阶段，产品在任一阶段被判定为NO后不再进入后续阶段
+    
+    综合结论为所有阶段都判定YES。每个产品的"判定阶段"记录作出决定的阶段；
+    审计模式(full_evaluation)下所有产品都会执行全部阶段，以便核对各阶段结论。
+    """
+    if stages is None:
+        stages = DECISION_STAGES
+    if full_evaluation is None:
+        full_evaluation = FULL_EVALUATION
+    stages = sorted(stages, key=lambda stage_name: DECISION_STAGE_REGISTRY[stage_name]["成本"])
+    
+    pending = list(records)
+    for stage_name in stages:
+        stage = DECISION_STAGE_REGISTRY[stage_name]
+        if full_evaluation:
+            targets = [record for record in records if not record["错误"]]
+        else:
+            targets = pending
+        if not targets:
+            break
+        
+        with METRICS.span('decision_stage', stage=stage_name):
+            verdicts = stage["函数"](targets, context)
+        METRICS.count('stage_evaluations', len(targets), stage=stage_name)
+        for record, (verdict, error) in zip(targets, verdicts):
+            record[stage["结果字段"]] = verdict
+            if error:
+                record["错误"] = error
+            elif verdict != 'YES' and record["判定阶段"] is None:
+                record["判定阶段"] = stage_name
+        pending = [record for record in pending if record["判定阶段"] is None and not record["错误"]]
+    
+    # 通过了所有阶段的产品判定为竞品，由最后一个阶段作出决定
+    for record in pending:
+        record["结论"] = 'YES'
+        record["判定阶段"] = stages[-1] if stages else None
+    return records
+
+def run_comparisons(my_product_file, amazon_files, my_product_keywords, max_workers=ANALYZE_MAX_WORKERS,
+                    search_term=None, titles=None, cancel_event=None):
+    """比较我的产品与所有亚马逊产品，结果按文件名顺序返回
+    
+    titles为{图片路径: 产品标题}，未提供时使用文件名作为标题进行标题分析。
+    cancel_event被设置后尚未开始的图像比较不再调用模型，记为错误。
+    """
+    titles = titles or {}
+    image_groups, _ = collapse_near_duplicates(amazon_files)
+    if not image_groups:
+        return []
+    
+    start_time = time.time()
+    records = [
+        {
+            "文件": os.path.basename(amazon_product_file),
+            "标题": titles.get(amazon_product_file) or os.path.basename(amazon_product_file),
+            "代表图片": image_group[0],
+            "图像结论": None,
+            "标题结论": None,
+            "视觉结论": None,
+            "视觉相似度": None,
+            "结论": "NO",
+            "判定阶段": None,
+            "错误": None
+        }
+        for image_group in image_groups
+        for amazon_product_file in image_group
+    ]
+    # 按文件名排序，保证输出顺序与线程完成顺序无关
+    records.sort(key=lambda record: record["文件"])
+    context = {
+        "search_term": search_term,
+        "my_product_file": my_product_file,
+        "my_product_keywords": my_product_keywords,
+        "max_workers": max_workers,
+        "cancel_event": cancel_event,
+    }
+    run_decision_cascade(records, context)
+    
+    stage_counts = {}
+    for record in records:
+        file = record["文件"]
+        if record["错误"]:
+            print(f"分析产品时出错 '{file}': {record['错误']}")
+            continue
+        stage_counts[record["判定阶段"]] = stage_counts.get(record["判定阶段"], 0) + 1
+        METRICS.count('products_analyzed', decided_by=record["判定阶段"], competitor=record["结论"] == 'YES')
+        print(f"产品 '{file}' 标题分析结论: {record['标题结论']}, 视觉相似度: {record['视觉相似度']}, "
+              f"图像分析结论: {record['图像结论']}")
+        if record["结论"] == 'YES':
+            print(f"产品 '{file}' 是竞品 ✅")
+        else:
+            print(f"产品 '{file}' 不是竞品 ❌ (由{record['判定阶段']}阶段判定)")
+    
+    elapsed = time.time() - start_time
+    throughput = len(records) / elapsed if elapsed > 0 else 0
+    print(f"分析完成: {len(records)} 个产品，各阶段判定数 {stage_counts}，"
+          f"耗时 {elapsed:.1f} 秒，吞吐量 {throughput:.2f} 个/秒")
+    return records
+
+#####################################
+# 检查点日志
+#####################################
+
+class CheckpointJournal:
+    """只追加的JSONL检查点日志，每条记录写入后立即刷盘
+    
+    进程中断时最多丢失正在写入的最后一行，读取时会跳过不完整的行。
+    """
+    
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._repair_tail()
+    
+    def _repair_tail(self):
+        """如果上次写入被中断导致最后一行不完整，补上换行符使后续记录从新行开始"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def append(self, record):
+        """追加一条记录并同步到磁盘"""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock, METRICS.span('journal_write'):
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def load(self):
+        """读取所有完整的记录"""
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # 中断时写了一半的行
+                    continue
+        return records
+    
+    def record_term_result(self, search_term, result, completed=True):
+        """记录一个搜索词的分析结果，completed为False表示该搜索词需要在重启后重试"""
+        self.append({
+            "type": "term",
+            "term": search_term,
+            "completed": completed,
+            "result": result,
+            "time": time.time()
+        })
+    
+    def load_term_results(self):
+        """按首次出现的顺序返回每个搜索词最新的记录"""
+        term_records = {}
+        for record in self.load():
+            if record.get("type") == "term":
+                term_records[record["term"]] = record
+        return term_records
+
+def export_report(journal_file=JOURNAL_FILE, output_file=REPORT_FILE, search_terms=None):
+    """根据检查点日志生成Excel报告，search_terms指定报告中搜索词的顺序"""
+    term_records = CheckpointJournal(journal_file).load_term_results()
+    if search_terms is None:
+        search_terms = list(term_records)
+    similarity_results = {
+        search_term: term_records[search_term]["result"]
+        for search_term in search_terms
+        if search_term in term_records
+    }
+    save_results_to_excel(similarity_results, output_file)
+    return similarity_results
+
+#####################################
+# 流水线
+#####################################
+
+def analyze_search_term(search_term, my_product_file, amazon_files, my_product_keywords,
+                        titles=None, cancel_event=None):
+    """分析一个搜索词下的所有亚马逊产品，返回相似度结果"""
+    # 计算相似度
+    comparison_results = run_comparisons(
+        my_product_file, amazon_files, my_product_keywords,
+        search_term=search_term, titles=titles, cancel_event=cancel_event
+    )
+    
+    total_count = len(comparison_results)
+    competitors = [result["文件"] for result in comparison_results if result["结论"] == 'YES']
+    competitor_count = len(competitors)
+    VERDICT_CACHE.report()
+    
+    # 计算相似度级别
+    similarity_level = calculate_similarity_level(competitor_count, total_count)
+    
+    return {
+        "相似度": similarity_level,
+        "竞品数量": competitor_count,
+        "总商品数": total_count,
+        "竞品百分比": round((competitor_count / total_count * 100), 2) if total_count > 0 else 0,
+        "竞品列表": competitors
+    }
+
+_PIPELINE_STOP = object()
+
+class PipelineStage:
+    """流水线中的一个阶段：多个工作线程从输入队列取任务，处理后放入输出队列
+    
+    任务中记录了失败原因时直接传递给下一阶段。所有工作线程收到结束标记后，
+    最后一个退出的线程向输出队列发送结束标记。stop_event被设置后工作线程
+    不再开始新任务，并放弃阻塞中的入队操作。
+    """
+    
+    def __init__(self, name, func, workers, input_queue, output_queue, stop_event):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stop_event = stop_event
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.depth_samples = []
+        self._active_workers = self.workers
+        self._threads = []
+        self._lock = threading.Lock()
+    
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def _put(self, target_queue, item):
+        """放入队列，队列已满时定期检查是否已取消，取消时返回False"""
+        while not self.stop_event.is_set():
+            try:
+                target_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    job = self.input_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if job is _PIPELINE_STOP:
+                    # 把结束标记放回队列，让同阶段的其他线程也能收到
+                    self._put(self.input_queue, _PIPELINE_STOP)
+                    return
+                self._process(job)
+        finally:
+            with self._lock:
+                self._active_workers -= 1
+                is_last = self._active_workers == 0
+            if is_last:
+                self._put(self.output_queue, _PIPELINE_STOP)
+    
+    def _process(self, job):
+        if job["failure"] is None:
+            start_time = time.time()
+            try:
+                self.func(job)
+            except Exception as e:
+                print(f"流水线阶段 {self.name} 处理 '{job['term']}' 时出错: {e}")
+                job["failure"] = f"意外错误: {str(e)[:100]}"
+            elapsed = time.time() - start_time
+            METRICS.observe('pipeline_stage', elapsed, error=job["failure"] is not None, stage=self.name)
+            with self._lock:
+                self.processed += 1
+                self.busy_seconds += elapsed
+        self._put(self.output_queue, job)
+    
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+    
+    def sample_depth(self):
+        """记录输入队列当前的长度"""
+        self.depth_samples.append(self.input_queue.qsize())
+    
+    def stats(self, elapsed):
+        """返回该阶段的处理数量、利用率和输入队列长度统计"""
+        samples = self.depth_samples or [0]
+        return {
+            "processed": self.processed,
+            "busy_seconds": round(self.busy_seconds, 2),
+            "utilization": self.busy_seconds / (self.workers * elapsed) if elapsed > 0 else 0.0,
+            "avg_queue_depth": sum(samples) / len(samples),
+            "max_queue_depth": max(samples),
+        }
+
+def run_analysis_pipeline(jobs, keyword_extractor, scraper_backend=None, report_interval=30, stop_event=None):
+    """以流水线方式并发执行爬取、下载、关键词提取和图像比较，按完成顺序逐个返回任务
+    
+    相邻阶段之间使用有界队列，因此下一个搜索词的爬取与当前搜索词的分析可以同时进行。
+    设置stop_event或关闭生成器会取消流水线：各阶段不再开始新任务，等待所有工作线程
+    退出后才关闭浏览器会话池和下载器。
+    """
+    if scraper_backend is None:
+        scraper_backend = SCRAPER_BACKEND
+    if scraper_backend not in ('http', 'selenium'):
+        raise ValueError(f"未知的爬虫后端: {scraper_backend}")
+    if not jobs:
+        return
+    if stop_event is None:
+        stop_event = threading.Event()
+    
+    downloader = ImageDownloader()
+    image_store = ImageStore(IMAGE_STORE_DIRECTORY) if IMAGE_STORE_DIRECTORY else None
+    browser_pool = None
+    http_session = None
+    scrape_count = sum(1 for job in jobs if job["needs_scrape"])
+    if scraper_backend == 'http':
+        scrape_workers = HTTP_POOL_SIZE
+        http_session = create_http_session(HTTP_POOL_SIZE)
+    else:
+        scrape_workers = BROWSER_POOL_SIZE
+        browser_pool = BrowserPool(size=max(1, min(BROWSER_POOL_SIZE, scrape_count)))
+    scrape_workers = max(1, min(scrape_workers, scrape_count))
+    
+    def scrape(job):
+        if not job["needs_scrape"]:
+            return
+        if scraper_backend == 'http':
+            job["products"], job["failure"] = scrape_search_term_http(http_session, job["term"], download=False)
+        else:
+            job["products"], job["failure"] = scrape_search_term(browser_pool, job["term"], download=False)
+    
+    def download(job):
+        if job["products"]:
+            download_product_images(job["products"], job["amazon_dir"], downloader, image_store)
+    
+    def extract_keywords(job):
+        try:
+            job["keywords"] = keyword_extractor.get(job["term"])
+            print(f"产品 '{job['term']}' 的关键词: {job['keywords']}")
+        except Exception as e:
+            print(f"获取关键词出错: {e}")
+            job["keywords"] = job["term"]
+    
+    def compare(job):
+        titles = manifest_image_titles(job["amazon_dir"], load_term_manifest(job["amazon_dir"]))
+        if not job["needs_scrape"]:
+            print(f"'{job['term']}' 使用已爬取的图片 ({len(titles)} 张)")
+        try:
+            job["result"] = analyze_search_term(
+                job["term"], job["my_product_file"], list(titles), job["keywords"],
+                titles=titles, cancel_event=stop_event
+            )
+        except TransientApiError as e:
+            # 已完成的比较都在判定缓存中，重新运行时只需补齐剩余的比较
+            print(f"搜索词 '{job['term']}' 的图像比较未完成: {e}")
+            job["failure"] = "视觉模型API暂时不可用"
+    
+    stage_specs = [
+        ("爬取", scrape, scrape_workers),
+        ("下载", download, PIPELINE_DOWNLOAD_WORKERS),
+        ("关键词", extract_keywords, PIPELINE_KEYWORD_WORKERS),
+        ("比较", compare, PIPELINE_COMPARE_WORKERS),
+    ]
+    # 第一个队列不限长度以便一次放入所有任务，之后的队列有界以限制在途任务数量
+    queues = [queue.Queue()] + [queue.Queue(maxsize=PIPELINE_QUEUE_SIZE) for _ in stage_specs]
+    stages = [
+        PipelineStage(name, func, workers, queues[i], queues[i + 1], stop_event)
+        for i, (name, func, workers) in enumerate(stage_specs)
+    ]
+    
+    start_time = time.time()
+    last_report = start_time
+    try:
+        for stage in stages:
+            stage.start()
+        for job in jobs:
+            queues[0].put(job)
+        queues[0].put(_PIPELINE_STOP)
+        
+        finished = 0
+        while not stop_event.is_set():
+            try:
+                job = queues[-1].get(timeout=1)
+            except queue.Empty:
+                job = None
+            
+            # 定期采样各阶段的队列长度
+            for stage in stages:
+                stage.sample_depth()
+            if time.time() - last_report >= report_interval:
+                last_report = time.time()
+                depths = ", ".join(f"{stage.name}:{stage.input_queue.qsize()}" for stage in stages)
+                print(f"流水线队列长度 [{depths}]")
+            
+            if job is _PIPELINE_STOP:
+                break
+            if job is None:
+                continue
+            finished += 1
+            print(f"\n处理进度: [{finished}/{len(jobs)}] 搜索词 '{job['term']}' 完成")
+            yield job
+    finally:
+        # 通知各阶段停止，清空队列释放阻塞中的线程，等所有工作线程退出后再释放资源
+        stop_event.set()
+        for pipeline_queue in queues:
+            while True:
+                try:
+                    pipeline_queue.get_nowait()
+                except queue.Empty:
+                    break
+        for stage in stages:
+            stage.join()
+        if browser_pool is not None:
+            browser_pool.close()
+        if http_session is not None:
+            http_session.close()
+        downloader.report()
+        if image_store is not None:
+            image_store.report()
+        downloader.close()
+        
+        elapsed = time.time() - start_time
+        print(f"流水线运行 {elapsed:.1f} 秒，各阶段统计:")
+        for stage in stages:
+            stats = stage.stats(elapsed)
+            print(f"  {stage.name}: 处理 {stats['processed']} 个，利用率 {stats['utilization'] * 100:.1f}%，"
+                  f"平均队列长度 {stats['avg_queue_depth']:.1f}，最大队列长度 {stats['max_queue_depth']}")
+
 #####################################
 # 整合工作流程
 #####################################
 
-def save_results_to_excel(similarity_results, output_file="产品相似度分析结果.xlsx"):
+def save_results_to_excel(similarity_results, output_file=REPORT_FILE):
     """将结果保存到Excel"""
     # 转换为DataFrame
     results_list = []
@@ -692,12 +4039,76 @@ def save_results_to_excel(similarity_results, output_file="产品相似度分析
     
     df = pd.DataFrame(results_list)
     
-    # 保存到Excel
-    df.to_excel(output_file, index=False)
+    # 保存到Excel（先写临时文件再替换，避免写入中断时损坏已有报告）
+    temp_file = f"{output_file}.tmp.xlsx"
+    with METRICS.span('report_write'):
+        df.to_excel(temp_file, index=False)
+        os.replace(temp_file, output_file)
     print(f"结果已保存到 {output_file}")
 
-def integrated_workflow(excel_file='./红白蓝五星窗户灯词库_更新_20250318_151413.xlsx'):
-    """整合的工作流程函数"""
+def build_failure_result(reason):
+    """构建无法评估的搜索词结果"""
+    return {
+        "相似度": "无法评估",
+        "原因": reason,
+        "竞品数量": 0,
+        "总商品数": 0,
+        "竞品百分比": 0,
+        "竞品列表": []
+    }
+
+def scrape_search_term(browser_pool, search_term, downloader=None, download=True):
+    """使用会话池中的浏览器爬取一个搜索词，返回(产品列表, 失败原因)，成功时失败原因为None"""
+    os.makedirs(os.path.join("images", search_term), exist_ok=True)
+    try:
+        with browser_pool.session() as driver:
+            # 搜索产品
+            if not search_amazon(driver, search_term):
+                print(f"搜索 '{search_term}' 失败")
+                return [], "搜索失败"
+            
+            # 提取产品信息并下载图片
+            products = extract_products(
+                driver, search_term, max_products=100, downloader=downloader, download=download
+            )
+            if not products:
+                print(f"未能提取到'{search_term}'的产品信息")
+                return [], "未找到相关产品"
+    except BrowserSessionError:
+        print("打开亚马逊网站失败")
+        return [], "打开亚马逊失败"
+    except WebDriverException as e:
+        print(f"WebDriver错误: {e}")
+        return [], f"WebDriver错误: {str(e)[:100]}"
+    except Exception as e:
+        print(f"意外错误: {e}")
+        return [], f"意外错误: {str(e)[:100]}"
+    return products, None
+
+def scrape_search_term_http(http_session, search_term, downloader=None, download=True):
+    """使用HTTP后端爬取一个搜索词，返回(产品列表, 失败原因)，成功时失败原因为None"""
+    try:
+        products = extract_products_http(
+            http_session, search_term, max_products=100, downloader=downloader, download=download
+        )
+        if not products:
+            print(f"未能提取到'{search_term}'的产品信息")
+            return [], "未找到相关产品"
+    except requests.RequestException as e:
+        print(f"搜索 '{search_term}' 失败: {e}")
+        return [], "搜索失败"
+    except Exception as e:
+        print(f"意外错误: {e}")
+        return [], f"意外错误: {str(e)[:100]}"
+    return products, None
+
+def integrated_workflow(excel_file='./红白蓝五星窗户灯词库_更新_20250318_151413.xlsx', scraper_backend=None,
+                        resume=True):
+    """整合的工作流程函数
+    
+    scraper_backend可选'selenium'或'http'，默认使用SCRAPER_BACKEND；
+    resume为True时跳过检查点日志中已完成的搜索词。
+    """
     
     # 1. 从Excel中提取搜索词
     print("步骤1: 从Excel提取搜索词")
@@ -708,175 +4119,82 @@ def integrated_workflow(excel_file='./红白蓝五星窗户灯词库_更新_2025
     os.makedirs("images", exist_ok=True)
     os.makedirs(MY_IMAGE_DIRECTORY, exist_ok=True)
     
-    # 结果字典
+    # 从检查点日志恢复已完成的搜索词
+    journal = CheckpointJournal(JOURNAL_FILE)
     similarity_results = {}
+    if resume:
+        for search_term, record in journal.load_term_results().items():
+            if record["completed"]:
+                similarity_results[search_term] = record["result"]
+        if similarity_results:
+            print(f"从检查点日志恢复 {len(similarity_results)} 个已完成的搜索词")
+    pending_terms = [search_term for search_term in search_terms if search_term not in similarity_results]
     
-    # 2. 对每个搜索词进行处理
-    for idx, search_term in enumerate(search_terms):
-        print(f"\n处理进度: [{idx+1}/{len(search_terms)}]")
-        print(f"开始处理搜索词: {search_term}")
-        
+    # 清理过期或超出大小上限的判定缓存
+    VERDICT_CACHE.evict()
+    
+    # 准备每个搜索词的任务，我的产品图片索引只构建一次
+    my_product_index = build_my_product_index()
+    jobs = []
+    for search_term in dict.fromkeys(pending_terms):
         # 检查我的产品图片是否存在
-        my_product_file = None
-        for file in os.listdir(MY_IMAGE_DIRECTORY):
-            if os.path.splitext(file)[1].lower() in IMAGE_EXTENSIONS:
-                product_name = os.path.splitext(file)[0]
-                if search_term == product_name:
-                    my_product_file = os.path.join(MY_IMAGE_DIRECTORY, file)
-                    break
-        
+        my_product_file = my_product_index.get(search_term)
         if not my_product_file:
             print(f"警告: 找不到与搜索词 '{search_term}' 匹配的产品图片")
-            similarity_results[search_term] = {
-                "相似度": "无法评估",
-                "原因": "找不到匹配的产品图片",
-                "竞品数量": 0,
-                "总商品数": 0,
-                "竞品百分比": 0,
-                "竞品列表": []
-            }
+            similarity_results[search_term] = build_failure_result("找不到匹配的产品图片")
+            journal.record_term_result(search_term, similarity_results[search_term], completed=False)
             continue
         
-        # 爬取亚马逊产品
         amazon_dir = os.path.join("images", search_term)
-        if not os.path.exists(amazon_dir) or len([f for f in os.listdir(amazon_dir) if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS]) == 0:
-            os.makedirs(amazon_dir, exist_ok=True)
-            
-            try:
-                # 使用上下文管理器创建和使用Web驱动程序
-                with create_driver(headless=False) as driver:
-                    print("浏览器成功初始化")
-                    
-                    # 打开亚马逊
-                    if open_amazon(driver):
-                        # 搜索产品
-                        if search_amazon(driver, search_term):
-                            # 提取产品信息并下载图片
-                            products = extract_products(driver, search_term, max_products=100)
-                            
-                            if not products:
-                                print(f"未能提取到'{search_term}'的产品信息")
-                                similarity_results[search_term] = {
-                                    "相似度": "无法评估",
-                                    "原因": "未找到相关产品",
-                                    "竞品数量": 0,
-                                    "总商品数": 0,
-                                    "竞品百分比": 0,
-                                    "竞品列表": []
-                                }
-                                continue
-                        else:
-                            print(f"搜索 '{search_term}' 失败")
-                            similarity_results[search_term] = {
-                                "相似度": "无法评估",
-                                "原因": "搜索失败",
-                                "竞品数量": 0,
-                                "总商品数": 0,
-                                "竞品百分比": 0,
-                                "竞品列表": []
-                            }
-                            continue
-                    else:
-                        print("打开亚马逊网站失败")
-                        similarity_results[search_term] = {
-                            "相似度": "无法评估",
-                            "原因": "打开亚马逊失败",
-                            "竞品数量": 0,
-                            "总商品数": 0,
-                            "竞品百分比": 0,
-                            "竞品列表": []
-                        }
-                        continue
-            
-            except WebDriverException as e:
-                print(f"WebDriver错误: {e}")
-                similarity_results[search_term] = {
-                    "相似度": "无法评估",
-                    "原因": f"WebDriver错误: {str(e)[:100]}",
-                    "竞品数量": 0,
-                    "总商品数": 0,
-                    "竞品百分比": 0,
-                    "竞品列表": []
-                }
-                continue
-            except Exception as e:
-                print(f"意外错误: {e}")
-                similarity_results[search_term] = {
-                    "相似度": "无法评估",
-                    "原因": f"意外错误: {str(e)[:100]}",
-                    "竞品数量": 0,
-                    "总商品数": 0,
-                    "竞品百分比": 0,
-                    "竞品列表": []
-                }
-                continue
-        else:
-            print(f"使用已爬取的图片 ({len([f for f in os.listdir(amazon_dir) if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS])} 张)")
-        
-        # 获取我的产品关键词
-        try:
-            my_product_keywords = get_keyword(
-                API_KEY, 
-                BASE_URL, 
-                'qwen-max-2025-01-25', 
-                search_term
-            )
-            print(f"产品 '{search_term}' 的关键词: {my_product_keywords}")
-        except Exception as e:
-            print(f"获取关键词出错: {e}")
-            my_product_keywords = search_term
-        
-        # 计算相似度
-        total_count = 0
-        competitor_count = 0
-        competitors = []
-        
-        # 遍历亚马逊产品目录中的所有图片
-        for file in os.listdir(amazon_dir):
-            if os.path.splitext(file)[1].lower() in IMAGE_EXTENSIONS:
-                total_count += 1
-                amazon_product_file = os.path.join(amazon_dir, file)
+        jobs.append({
+            "term": search_term,
+            "my_product_file": my_product_file,
+            "amazon_dir": amazon_dir,
+            # 清单中的图片都已被删除时重新爬取
+            "needs_scrape": not manifest_image_titles(amazon_dir, load_term_manifest(amazon_dir)),
+            "products": None,
+            "keywords": None,
+            "result": None,
+            "failure": None
+        })
+    
+    # 只为实际进入流水线的搜索词批量提取关键词（已缓存的不再调用API）
+    keyword_extractor = KeywordExtractor(API_KEY, BASE_URL, KEYWORD_MODEL, cache_file=KEYWORD_CACHE_FILE)
+    keyword_extractor.prefetch([job["term"] for job in jobs])
+    
+    # 2. 通过流水线并发执行爬取、下载、关键词提取和图像比较
+    print(f"\n步骤2: 处理 {len(jobs)} 个搜索词 (爬取 {sum(1 for job in jobs if job['needs_scrape'])} 个)")
+    try:
+        # 中断(如Ctrl+C)时立即关闭流水线，等待工作线程退出后再释放浏览器和下载器
+        with closing(run_analysis_pipeline(jobs, keyword_extractor, scraper_backend)) as pipeline:
+            for job in pipeline:
+                if job["failure"] is not None:
+                    similarity_results[job["term"]] = build_failure_result(job["failure"])
+                else:
+                    similarity_results[job["term"]] = job["result"]
                 
-                try:
-                    print(f"分析产品 '{file}'...")
-                    # 图像分析
-                    img_conclusion = get_img_analyze(my_product_file, amazon_product_file)
-                    print(f"图像分析结论: {img_conclusion}")
-                    
-                    # 标题分析
-                    title_conclusion = get_title_analyze(my_product_keywords, file)
-                    print(f"标题分析结论: {title_conclusion}")
-                    
-                    # 综合结论
-                    conclusion = 'YES' if img_conclusion == 'YES' and title_conclusion == 'YES' else 'NO'
-                    
-                    if conclusion == 'YES':
-                        competitor_count += 1
-                        competitors.append(file)
-                        print(f"产品 '{file}' 是竞品 ✅")
-                    else:
-                        print(f"产品 '{file}' 不是竞品 ❌")
-                except Exception as e:
-                    print(f"分析产品时出错 '{file}': {e}")
-        
-        # 计算相似度级别
-        similarity_level = calculate_similarity_level(competitor_count, total_count)
-        
-        # 将结果添加到字典
-        similarity_results[search_term] = {
-            "相似度": similarity_level,
-            "竞品数量": competitor_count,
-            "总商品数": total_count,
-            "竞品百分比": round((competitor_count / total_count * 100), 2) if total_count > 0 else 0,
-            "竞品列表": competitors
-        }
+                # 每处理完一个搜索词就追加写入检查点日志
+                journal.record_term_result(job["term"], similarity_results[job["term"]], completed=job["failure"] is None)
+                METRICS.count('terms_processed', result='completed' if job["failure"] is None else 'failed')
+                UPLOAD_CACHE.flush()
+                # 每个搜索词完成后刷新指标文件，长时间运行时也能随时查看
+                METRICS.export(METRICS_SUMMARY_FILE, METRICS_PROMETHEUS_FILE, verbose=False)
         
-        # 每处理完一个搜索词就保存一次中间结果
+        # 3. 输出最终结果并保存到Excel
+        keyword_extractor.report()
+        VISION_API_CLIENT.report()
+        STREAMING_STATS.report()
+        UPLOAD_CACHE.flush()
+        UPLOAD_CACHE.report()
+        TEXT_API_CLIENT.report()
+        PACING_STATS.report()
+        LOCATOR_ENGINE.report()
+        print("\n步骤3: 输出最终结果并保存到Excel")
+        similarity_results = {search_term: similarity_results[search_term] for search_term in dict.fromkeys(search_terms)}
         save_results_to_excel(similarity_results)
-    
-    # 3. 输出最终结果并保存到Excel
-    print("\n步骤3: 输出最终结果并保存到Excel")
-    save_results_to_excel(similarity_results)
+    finally:
+        # 出错或中断时也导出已记录的指标
+        METRICS.export(METRICS_SUMMARY_FILE, METRICS_PROMETHEUS_FILE)
     
     return similarity_results
 
@@ -885,4 +4203,22 @@ def integrated_workflow(excel_file='./红白蓝五星窗户灯词库_更新_2025
 #####################################
 
 if __name__ == "__main__":
-    integrated_workflow()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="亚马逊产品竞争性分析")
+    parser.add_argument('excel_file', nargs='?', default='./红白蓝五星窗户灯词库_更新_20250318_151413.xlsx',
+                        help="包含搜索词的Excel文件")
+    parser.add_argument('--report', action='store_true', help="只根据检查点日志生成Excel报告")
+    parser.add_argument('--no-resume', action='store_true', help="忽略检查点日志中已完成的搜索词")
+    parser.add_argument('--benchmark-tiers', type=int, metavar='N',
+                        help="抽取N对已下载的图片，比较各图片预处理分级的延迟、token用量和结论一致率")
+    parser.add_argument('--visual-agreement', type=int, metavar='N',
+                        help="抽取N对已下载的图片，对照判定缓存中的模型结论评估视觉预筛选的阈值")
+    args = parser.parse_args()
+    
+    if args.benchmark_tiers:
+        benchmark_image_tiers(sample_benchmark_pairs(args.benchmark_tiers))
+    elif args.visual_agreement:
+        visual_agreement_report(sample_benchmark_pairs(args.visual_agreement))
+    elif args.report:
+        export_report()
+    else:
+        integrated_workflow(args.excel_file, resume=not args.no_resume)
@@ -0,0 +1,558 @@
+import os
+import io
+import re
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import hashlib
+import tempfile
+import threading
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pandas as pd
+from PIL import Image, ImageDraw
+
+#####################################
+# 配置参数
+#####################################
+
+# 离线基准测试：在本地启动一个HTTP服务器，同时充当亚马逊搜索页、图片服务器、
+# DashScope视觉模型与临时存储、OpenAI兼容的文本模型，在不访问外网的情况下运行完整的integrated_workflow
+DEFAULT_TERMS = 20
+DEFAULT_PRODUCTS_PER_PAGE = 16
+DEFAULT_PAGES = 3
+DEFAULT_SHARED_IMAGE_RATIO = 0.2  # 在多个搜索词之间共用的图片比例，用于测试跨搜索词的图片去重
+DEFAULT_TITLE_MATCH_RATIO = 0.6  # 标题包含关键词的产品比例
+DEFAULT_YES_RATIO = 0.3  # 假视觉模型判定为竞品的比例
+
+DEFAULT_VLM_LATENCY = 1.0  # 假视觉模型输出第一段文字前的延迟(秒)
+DEFAULT_VLM_CHUNK_DELAY = 0.02  # 假视觉模型每输出一段文字的延迟(秒)
+DEFAULT_VLM_OUTPUT_CHUNKS = 40  # 结论之后的理由段数
+DEFAULT_LLM_LATENCY = 0.3  # 假文本模型的延迟(秒)
+DEFAULT_ERROR_RATE = 0.02  # 模型接口随机返回500的比例
+DEFAULT_RATE_LIMIT_RPM = 600  # 模型接口每分钟允许的请求数，超出返回429；0表示不限制
+
+IMAGE_SIZE = 400
+
+#####################################
+# 假数据生成
+#####################################
+
+def term_name(index):
+    """第index个搜索词，去掉前面的编号后即为假文本模型返回的关键词"""
+    return f"{index:03d} window light"
+
+def render_product_image(image_id, seed):
+    """按图片编号生成确定的产品图片：随机形状和颜色，并加入噪点以免被当作纯色占位图"""
+    rng = random.Random(f"{seed}:{image_id}")
+    background = tuple(rng.randint(200, 255) for _ in range(3))
+    color = tuple(rng.randint(0, 200) for _ in range(3))
+    img = Image.new('RGB', (IMAGE_SIZE, IMAGE_SIZE), background)
+    draw = ImageDraw.Draw(img)
+    shape = rng.choice(['star', 'circle', 'rectangle'])
+    center, radius = IMAGE_SIZE / 2, IMAGE_SIZE * rng.uniform(0.25, 0.4)
+    if shape == 'star':
+        points = []
+        for i in range(10):
+            angle = i * math.pi / 5 - math.pi / 2
+            length = radius if i % 2 == 0 else radius * 0.45
+            points.append((center + length * math.cos(angle), center + length * math.sin(angle)))
+        draw.polygon(points, fill=color)
+    elif shape == 'circle':
+        draw.ellipse((center - radius, center - radius, center + radius, center + radius), fill=color)
+    else:
+        draw.rectangle((center - radius, center - radius * 0.6, center + radius, center + radius * 0.6), fill=color)
+    for _ in range(300):
+        x, y = rng.randrange(IMAGE_SIZE), rng.randrange(IMAGE_SIZE)
+        draw.point((x, y), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+class FakeCatalog:
+    """生成并缓存每个搜索词的搜索结果页和产品图片
+    
+    提供fixtures_dir时优先使用录制的页面<fixtures_dir>/<搜索词>/page<N>.html
+    和图片<fixtures_dir>/images/<文件名>，没有录制的部分使用生成的数据。
+    """
+    
+    def __init__(self, products_per_page, pages, shared_ratio, title_match_ratio, seed, fixtures_dir=None):
+        self.products_per_page = products_per_page
+        self.pages = pages
+        self.shared_ratio = shared_ratio
+        self.title_match_ratio = title_match_ratio
+        self.seed = seed
+        self.fixtures_dir = fixtures_dir
+        self._images = {}
+        self._lock = threading.Lock()
+    
+    def search_page(self, term, page):
+        """返回搜索结果页HTML，页码超出范围时返回没有产品的页面"""
+        if self.fixtures_dir:
+            recorded = os.path.join(self.fixtures_dir, term, f"page{page}.html")
+            if os.path.exists(recorded):
+                with open(recorded, 'r', encoding='utf-8') as f:
+                    return f.read()
+        if page > self.pages:
+            return "<html><body></body></html>"
+        
+        rng = random.Random(f"{self.seed}:{term}:{page}")
+        cards = []
+        for position in range(self.products_per_page):
+            product_index = (page - 1) * self.products_per_page + position
+            asin = hashlib.md5(f"{term}:{product_index}".encode('utf-8')).hexdigest()[:10].upper()
+            if rng.random() < self.shared_ratio:
+                # 共用图片池中的图片会出现在多个搜索词下
+                image_name = f"shared-{rng.randrange(self.products_per_page * 2)}.jpg"
+            else:
+                image_name = f"{asin}.jpg"
+            if rng.random() < self.title_match_ratio:
+                title = f"Window Light {rng.choice(['Star', 'Hanging', 'Solar', 'LED'])} Model {product_index}"
+            else:
+                title = f"Garden Lamp {rng.choice(['Outdoor', 'Patio', 'Pathway'])} Model {product_index}"
+            cards.append(
+                f'<div data-component-type="s-search-result" data-asin="{asin}" class="s-result-item s-asin">'
+                f'<h2><a href="/dp/{asin}"><span>{title}</span></a></h2>'
+                f'<img class="s-image" src="/img/{image_name}" srcset="/img/{image_name} 1x"></div>'
+            )
+        return f"<html><body>{''.join(cards)}</body></html>"
+    
+    def image(self, name):
+        """返回图片内容，生成的图片按文件名缓存"""
+        if self.fixtures_dir:
+            recorded = os.path.join(self.fixtures_dir, 'images', name)
+            if os.path.exists(recorded):
+                with open(recorded, 'rb') as f:
+                    return f.read()
+        with self._lock:
+            data = self._images.get(name)
+        if data is None:
+            data = render_product_image(name, self.seed)
+            with self._lock:
+                self._images[name] = data
+        return data
+
+#####################################
+# 假服务器
+#####################################
+
+class ServerStats:
+    """按接口统计假服务器收到的请求和返回的状态码"""
+    
+    def __init__(self):
+        self.requests = {}
+        self.statuses = {}
+        self._lock = threading.Lock()
+    
+    def record(self, endpoint, status):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            key = f"{endpoint}:{status}"
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+    
+    def snapshot(self):
+        with self._lock:
+            return {"requests": dict(self.requests), "statuses": dict(self.statuses)}
+
+class SlidingWindowLimiter:
+    """假模型接口的服务端限流：统计最近60秒的请求数"""
+    
+    def __init__(self, rpm):
+        self.rpm = rpm
+        self._times = deque()
+        self._lock = threading.Lock()
+    
+    def allow(self):
+        """允许本次请求时返回(True, 0)，否则返回(False, 建议等待秒数)"""
+        if not self.rpm:
+            return True, 0
+        now = time.monotonic()
+        with self._lock:
+            while self._times and now - self._times[0] >= 60:
+                self._times.popleft()
+            if len(self._times) >= self.rpm:
+                return False, 60 - (now - self._times[0])
+            self._times.append(now)
+        return True, 0
+
+class BenchmarkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, *args):
+        pass
+    
+    @property
+    def options(self):
+        return self.server.options
+    
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+    
+    def _inject_failure(self, endpoint, limiter):
+        """按配置模拟限流和服务端错误，已返回错误响应时返回True"""
+        allowed, retry_after = limiter.allow()
+        if not allowed:
+            self.server.stats.record(endpoint, 429)
+            self._send(429, {"code": "Throttling.RateQuota", "message": "Requests rate limit exceeded"},
+                       headers={'Retry-After': f"{retry_after:.1f}"})
+            return True
+        if self.server.rng_random() < self.options["error_rate"]:
+            self.server.stats.record(endpoint, 500)
+            self._send(500, {"code": "InternalError", "message": "injected failure"})
+            return True
+        return False
+    
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path == '/s':
+            page = int(query.get('page', ['1'])[0])
+            self.server.stats.record('search', 200)
+            self._send(200, self.server.catalog.search_page(query.get('k', [''])[0], page), 'text/html; charset=utf-8')
+        elif parts.path.startswith('/img/'):
+            self.server.stats.record('image', 200)
+            self._send(200, self.server.catalog.image(parts.path[len('/img/'):]), 'image/jpeg')
+        elif parts.path == '/api/v1/uploads':
+            # DashScope临时存储的上传凭证
+            self.server.stats.record('upload_policy', 200)
+            self._send(200, {"request_id": "benchmark", "data": {
+                "policy": "benchmark", "signature": "benchmark", "upload_dir": "benchmark/uploads",
+                "upload_host": f"{self.server.url}/oss", "oss_access_key_id": "benchmark",
+                "x_oss_object_acl": "private", "x_oss_forbid_overwrite": "true",
+            }})
+        else:
+            self.server.stats.record('unknown', 404)
+            self._send(404, {"code": "NotFound", "message": self.path})
+    
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        body = self._read_body()
+        if parts.path == '/oss':
+            self.server.stats.record('upload', 200)
+            self.server.upload_bytes += len(body)
+            self._send(200, b'', 'text/plain')
+        elif parts.path.endswith('/services/aigc/multimodal-generation/generation'):
+            self._handle_vlm(json.loads(body))
+        elif parts.path.endswith('/chat/completions'):
+            self._handle_llm(json.loads(body))
+        else:
+            self.server.stats.record('unknown', 404)
+            self._send(404, {"code": "NotFound", "message": self.path})
+    
+    def _handle_vlm(self, payload):
+        if self._inject_failure('vlm', self.server.vlm_limiter):
+            return
+        content = payload["input"]["messages"][-1]["content"]
+        images = [item["image"] for item in content if "image" in item]
+        text = "".join(item.get("text", "") for item in content)
+        my_image, candidates = images[0], images[1:]
+        
+        def verdict(candidate):
+            digest = hashlib.sha256(f"{my_image}|{candidate}".encode('utf-8')).digest()
+            return 'YES' if digest[0] / 255 < self.options["yes_ratio"] else 'NO'
+        
+        if '只输出一个JSON数组' in text:
+            # 批量比较
+            reply = json.dumps([
+                {"候选": i + 1, "结论": verdict(candidate), "理由": "基准测试"} for i, candidate in enumerate(candidates)
+            ], ensure_ascii=False)
+            chunks = [reply]
+        else:
+            chunks = [f"结论：{verdict(candidates[0])}\n", "理由："]
+            chunks += [f"第{i + 1}段基准测试理由。" for i in range(self.options["vlm_output_chunks"])]
+        usage = {"input_tokens": 800 * len(images) + len(text), "output_tokens": 0}
+        
+        time.sleep(self.options["vlm_latency"])
+        if self.headers.get('X-DashScope-SSE') == 'enable':
+            self._stream_vlm(chunks, usage)
+            return
+        time.sleep(self.options["vlm_chunk_delay"] * len(chunks))
+        usage["output_tokens"] = sum(len(chunk) for chunk in chunks)
+        self.server.stats.record('vlm', 200)
+        self._send(200, {
+            "request_id": "benchmark",
+            "output": {"choices": [{"finish_reason": "stop", "message": {
+                "role": "assistant", "content": [{"text": "".join(chunks)}]
+            }}]},
+            "usage": usage,
+        })
+    
+    def _stream_vlm(self, chunks, usage):
+        """以增量SSE事件逐段返回回复，客户端断开连接后停止生成"""
+        self.server.stats.record('vlm', 200)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for position, chunk in enumerate(chunks):
+                usage = dict(usage, output_tokens=usage["output_tokens"] + len(chunk))
+                event = {
+                    "request_id": "benchmark",
+                    "output": {"choices": [{
+                        "finish_reason": "stop" if position == len(chunks) - 1 else "null",
+                        "message": {"role": "assistant", "content": [{"text": chunk}]},
+                    }]},
+                    "usage": usage,
+                }
+                self.wfile.write(f"id:{position + 1}\nevent:result\ndata:{json.dumps(event, ensure_ascii=False)}\n\n"
+                                 .encode('utf-8'))
+                self.wfile.flush()
+                self.server.generated_chunks += 1
+                time.sleep(self.options["vlm_chunk_delay"])
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端得到结论后断开了连接
+            self.server.cancelled_streams += 1
+    
+    def _handle_llm(self, payload):
+        if self._inject_failure('llm', self.server.llm_limiter):
+            return
+        time.sleep(self.options["llm_latency"])
+        prompt = payload["messages"][-1]["content"]
+        names = re.findall(r'^\d+\. (.+)$', prompt, re.MULTILINE)
+        if names:
+            # 批量提取，按顺序返回JSON数组
+            reply = json.dumps([re.sub(r'^\d+\s*', '', name) for name in names], ensure_ascii=False)
+        else:
+            match = re.search(r'那么"(.+?)"这是商品名字', prompt)
+            reply = re.sub(r'^\d+\s*', '', match.group(1)) if match else 'window light'
+        self.server.stats.record('llm', 200)
+        self._send(200, {
+            "id": "benchmark", "object": "chat.completion", "created": int(time.time()), "model": payload["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": reply}}],
+            "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(reply),
+                      "total_tokens": len(prompt) + len(reply)},
+        })
+
+class BenchmarkServer(ThreadingHTTPServer):
+    """同时提供假亚马逊、假图片、假DashScope和假OpenAI接口的本地服务器"""
+    
+    daemon_threads = True
+    
+    def __init__(self, catalog, options, port=0):
+        super().__init__(('127.0.0.1', port), BenchmarkHandler)
+        self.catalog = catalog
+        self.options = options
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.stats = ServerStats()
+        self.vlm_limiter = SlidingWindowLimiter(options["rate_limit_rpm"])
+        self.llm_limiter = SlidingWindowLimiter(options["rate_limit_rpm"])
+        self.upload_bytes = 0
+        self.generated_chunks = 0
+        self.cancelled_streams = 0
+        self._rng = random.Random(options["seed"])
+        self._rng_lock = threading.Lock()
+    
+    def rng_random(self):
+        with self._rng_lock:
+            return self._rng.random()
+    
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+#####################################
+# 运行基准测试
+#####################################
+
+def prepare_workdir(workdir, terms, catalog):
+    """在工作目录中写入搜索词Excel和我的产品图片，返回Excel路径"""
+    os.makedirs(os.path.join(workdir, 'my_product_images'), exist_ok=True)
+    for term in terms:
+        with open(os.path.join(workdir, 'my_product_images', f"{term}.jpg"), 'wb') as f:
+            f.write(catalog.image(f"my-{term}.jpg"))
+    excel_file = os.path.join(workdir, 'benchmark_terms.xlsx')
+    pd.DataFrame({"流量词": terms}).to_excel(excel_file, index=False)
+    return excel_file
+
+def summarize_latency(metrics_summary):
+    """从运行指标中取出各环节的耗时分位数，键为"名称{标签}" """
+    latency = {}
+    for series in metrics_summary["spans"]:
+        labels = ",".join(f"{key}={value}" for key, value in sorted(series["labels"].items()))
+        key = f"{series['name']}{{{labels}}}" if labels else series["name"]
+        latency[key] = {
+            "count": series["count"],
+            "errors": series["errors"],
+            "avg": series["sum"] / series["count"] if series["count"] else 0.0,
+            "p50": series["p50"],
+            "p95": series["p95"],
+            "p99": series["p99"],
+            "max": series["max"],
+        }
+    return latency
+
+def summarize_counters(metrics_summary, name):
+    counters = {}
+    for series in metrics_summary["counters"]:
+        if series["name"] == name:
+            labels = ",".join(f"{key}={value}" for key, value in sorted(series["labels"].items()))
+            counters[labels or name] = series["value"]
+    return counters
+
+def run_benchmark(options):
+    """启动假服务器，在临时工作目录中运行完整的integrated_workflow，返回基准测试结果"""
+    catalog = FakeCatalog(
+        options["products_per_page"], options["pages"], options["shared_ratio"],
+        options["title_match_ratio"], options["seed"], options["fixtures_dir"]
+    )
+    server = BenchmarkServer(catalog, options).start()
+    workdir = options["workdir"] or tempfile.mkdtemp(prefix='amazon_benchmark_')
+    terms = [term_name(index) for index in range(options["terms"])]
+    excel_file = prepare_workdir(workdir, terms, catalog)
+    
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # 在工作目录中导入，使各类缓存和输出文件都写入工作目录
+        import dashscope
+        import amazon_product_analysis as app
+        dashscope.base_http_api_url = f"{server.url}/api/v1"
+        app.API_KEY = 'benchmark'
+        app.BASE_URL = f"{server.url}/v1"
+        app.AMAZON_BASE_URL = server.url
+        app.UPLOAD_CACHE.policy_url = f"{server.url}/api/v1/uploads"
+        app.VLM_STREAMING = options["streaming"]
+        app.VLM_BATCH_SIZE = options["batch_size"]
+        if options["client_rpm"]:
+            app.VISION_API_CLIENT.limiter.rpm = options["client_rpm"]
+            app.TEXT_API_CLIENT.limiter.rpm = options["client_rpm"]
+        
+        start_time = time.time()
+        results = app.integrated_workflow(excel_file, scraper_backend='http', resume=False)
+        wall_seconds = time.time() - start_time
+        metrics_summary = app.METRICS.summary()
+    finally:
+        os.chdir(original_cwd)
+        server.shutdown()
+        server.server_close()
+        if not options["workdir"] and not options["keep_workdir"]:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    completed = sum(1 for result in results.values() if "原因" not in result)
+    return {
+        "options": options,
+        "time": time.time(),
+        "wall_seconds": wall_seconds,
+        "terms": len(terms),
+        "terms_completed": completed,
+        "terms_per_hour": completed / wall_seconds * 3600 if wall_seconds > 0 else 0.0,
+        "products_analyzed": sum(summarize_counters(metrics_summary, 'products_analyzed').values()),
+        "latency": summarize_latency(metrics_summary),
+        "api_calls": summarize_counters(metrics_summary, 'api_calls'),
+        "api_retries": summarize_counters(metrics_summary, 'api_retries'),
+        "api_tokens": summarize_counters(metrics_summary, 'api_tokens'),
+        "cache_lookups": summarize_counters(metrics_summary, 'cache_lookups'),
+        "server": dict(
+            server.stats.snapshot(),
+            upload_bytes=server.upload_bytes,
+            generated_chunks=server.generated_chunks,
+            cancelled_streams=server.cancelled_streams,
+        ),
+    }
+
+def print_report(report, previous=None):
+    """输出基准测试结果，提供上一次的结果时同时输出变化"""
+    def change(current, old):
+        if old in (None, 0):
+            return ""
+        return f" ({(current - old) / old * 100:+.1f}%)"
+    
+    prev_latency = previous["latency"] if previous else {}
+    print(f"\n离线基准测试: {report['terms_completed']}/{report['terms']} 个搜索词完成，"
+          f"耗时 {report['wall_seconds']:.1f} 秒，分析 {report['products_analyzed']} 个产品")
+    print(f"吞吐量: {report['terms_per_hour']:.0f} 个搜索词/小时"
+          f"{change(report['terms_per_hour'], previous['terms_per_hour'] if previous else None)}")
+    print("各环节耗时(秒):")
+    for key, stats in sorted(report["latency"].items()):
+        old = prev_latency.get(key, {})
+        print(f"  {key}: {stats['count']} 次，P50 {stats['p50']:.3f}{change(stats['p50'], old.get('p50'))}，"
+              f"P95 {stats['p95']:.3f}{change(stats['p95'], old.get('p95'))}，P99 {stats['p99']:.3f}，"
+              f"错误 {stats['errors']} 次")
+    print(f"API调用(客户端): {report['api_calls']}，重试 {report['api_retries']}，token {report['api_tokens']}")
+    print(f"假服务器: 请求 {report['server']['requests']}，状态码 {report['server']['statuses']}，"
+          f"中途断开的流 {report['server']['cancelled_streams']} 个")
+    print(f"缓存: {report['cache_lookups']}")
+
+#####################################
+# 主程序
+#####################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="使用本地假服务器对完整分析流程进行离线基准测试")
+    parser.add_argument('--terms', type=int, default=DEFAULT_TERMS, help="搜索词数量")
+    parser.add_argument('--products-per-page', type=int, default=DEFAULT_PRODUCTS_PER_PAGE)
+    parser.add_argument('--pages', type=int, default=DEFAULT_PAGES, help="每个搜索词的结果页数")
+    parser.add_argument('--shared-ratio', type=float, default=DEFAULT_SHARED_IMAGE_RATIO)
+    parser.add_argument('--title-match-ratio', type=float, default=DEFAULT_TITLE_MATCH_RATIO)
+    parser.add_argument('--yes-ratio', type=float, default=DEFAULT_YES_RATIO)
+    parser.add_argument('--vlm-latency', type=float, default=DEFAULT_VLM_LATENCY)
+    parser.add_argument('--vlm-chunk-delay', type=float, default=DEFAULT_VLM_CHUNK_DELAY)
+    parser.add_argument('--vlm-output-chunks', type=int, default=DEFAULT_VLM_OUTPUT_CHUNKS)
+    parser.add_argument('--llm-latency', type=float, default=DEFAULT_LLM_LATENCY)
+    parser.add_argument('--error-rate', type=float, default=DEFAULT_ERROR_RATE)
+    parser.add_argument('--rate-limit-rpm', type=int, default=DEFAULT_RATE_LIMIT_RPM,
+                        help="假模型接口每分钟允许的请求数，0表示不限制")
+    parser.add_argument('--client-rpm', type=int, default=0, help="覆盖客户端限流的每分钟请求数")
+    parser.add_argument('--no-streaming', action='store_true', help="关闭流式比较")
+    parser.add_argument('--batch-size', type=int, default=1, help="批量图像比较的候选数量")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fixtures-dir', help="录制的搜索结果页和图片目录")
+    parser.add_argument('--workdir', help="工作目录（默认使用临时目录，运行结束后删除）")
+    parser.add_argument('--keep-workdir', action='store_true', help="保留临时工作目录")
+    parser.add_argument('--output', help="把结果写入JSON文件")
+    parser.add_argument('--compare', help="与之前保存的JSON结果比较")
+    args = parser.parse_args()
+    
+    options = {
+        "terms": args.terms,
+        "products_per_page": args.products_per_page,
+        "pages": args.pages,
+        "shared_ratio": args.shared_ratio,
+        "title_match_ratio": args.title_match_ratio,
+        "yes_ratio": args.yes_ratio,
+        "vlm_latency": args.vlm_latency,
+        "vlm_chunk_delay": args.vlm_chunk_delay,
+        "vlm_output_chunks": args.vlm_output_chunks,
+        "llm_latency": args.llm_latency,
+        "error_rate": args.error_rate,
+        "rate_limit_rpm": args.rate_limit_rpm,
+        "client_rpm": args.client_rpm,
+        "streaming": not args.no_streaming,
+        "batch_size": args.batch_size,
+        "seed": args.seed,
+        "fixtures_dir": os.path.abspath(args.fixtures_dir) if args.fixtures_dir else None,
+        "workdir": os.path.abspath(args.workdir) if args.workdir else None,
+        "keep_workdir": args.keep_workdir,
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    
+    report = run_benchmark(options)
+    print_report(report, previous)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"结果已保存到 {args.output}")